@@ -1,14 +1,16 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, BackgroundTasks
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, BackgroundTasks, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
+import math
 import asyncio
+import time
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator
 import uuid
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
@@ -16,19 +18,26 @@ from passlib.context import CryptContext
 import httpx
 from enum import Enum
 import base64
-from io import BytesIO
+from io import BytesIO, TextIOWrapper
+import tempfile
 import re
 import hashlib
+import json
+import orjson
+import numpy as np
+from pypdf import PdfReader, PdfWriter
 from openpyxl import Workbook
 from openpyxl.drawing.image import Image as XLImage
-from openpyxl.styles import Font, Alignment, Border, Side
-from reportlab.lib import colors
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+from openpyxl.styles import Font, Alignment, Border, Side, NamedStyle
 from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image as RLImage, Flowable
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch, cm
-from fastapi.responses import StreamingResponse
+from reportlab.lib.utils import ImageReader, simpleSplit
+from reportlab.pdfgen.canvas import Canvas
+from fastapi.responses import StreamingResponse, Response, ORJSONResponse
 import csv
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import unquote, urlparse, parse_qs
 import aiohttp
 import subprocess
@@ -54,6 +63,15 @@ def clean_docs(docs):
     """Remove MongoDB _id field from list of documents"""
     return [clean_doc(doc) for doc in docs]
 
+def _etag_json_response(request: Request, payload: Any) -> Response:
+    """JSON response with an ETag; 304 when the client already has this payload."""
+    body = orjson.dumps(payload, default=str)
+    etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 def _normalize_identity_str(value: Optional[str]) -> str:
     if value is None:
         return ""
@@ -95,7 +113,7 @@ security = HTTPBearer()
 security_optional = HTTPBearer(auto_error=False)
 
 # Create the main app
-app = FastAPI(title="SharkDrop WMS API")
+app = FastAPI(title="SharkDrop WMS API", default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -2207,6 +2225,16 @@ async def _get_inventory_levels_with_fallback(location_id: Optional[str]):
         return inventory
 
     products = await db.products.find({"is_active": True}, {"_id": 0}).to_list(10000)
+    inventory.extend(_fallback_inventory_levels(products, fallback_location, variant_ids))
+    return inventory
+
+
+def _fallback_inventory_levels(products: List[dict], fallback_location: dict, variant_ids: set) -> List[dict]:
+    """Synthetic levels from Shopify inventory_quantity for variants without stored inventory.
+
+    `variant_ids` holds the variants already covered and is updated in place.
+    """
+    fallback = []
     for product in products:
         for variant in product.get("variants", []):
             variant_id = variant.get("id")
@@ -2223,7 +2251,7 @@ async def _get_inventory_levels_with_fallback(location_id: Optional[str]):
             if qty <= 0:
                 continue
 
-            inventory.append({
+            fallback.append({
                 "id": f"fallback-{variant_id}",
                 "variant_id": variant_id,
                 "product_id": product.get("id"),
@@ -2235,8 +2263,7 @@ async def _get_inventory_levels_with_fallback(location_id: Optional[str]):
                 "last_synced_at": None
             })
             variant_ids.add(variant_id)
-
-    return inventory
+    return fallback
 
 
 @api_router.get("/inventory")
@@ -2397,6 +2424,7 @@ async def receive_inventory(data: ReceiveRequest, current_user: dict = Depends(g
         username=current_user["username"]
     )
     await db.inventory_transactions.insert_one(tx.dict())
+    _invalidate_dashboard_cache()
 
     # Keep Shopify quantity aligned with local WMS quantity changes.
     shopify_updated = await update_shopify_inventory(data.variant_id, data.quantity, current_user)
@@ -2472,6 +2500,7 @@ async def move_inventory(data: MoveRequest, current_user: dict = Depends(get_cur
         user_id=current_user["id"]
     )
     await db.inventory_transactions.insert_one(tx.dict())
+    _invalidate_dashboard_cache()
     
     return {"message": "Inventory moved", "transaction_id": tx.id}
 
@@ -2540,6 +2569,7 @@ async def transfer_inventory(data: TransferRequest, current_user: dict = Depends
         user_id=current_user["id"]
     )
     await db.inventory_transactions.insert_one(tx.dict())
+    _invalidate_dashboard_cache()
     
     return {"message": "Inventory transferred", "transaction_id": tx.id}
 
@@ -2588,6 +2618,7 @@ async def sale_inventory(data: SaleRequest, current_user: dict = Depends(get_cur
         username=current_user["username"]
     )
     await db.inventory_transactions.insert_one(tx.dict())
+    _invalidate_dashboard_cache()
     
     # Update Shopify inventory (subtract quantity)
     shopify_updated = await update_shopify_inventory(data.variant_id, -data.quantity, current_user)
@@ -2651,6 +2682,7 @@ async def adjust_inventory(data: AdjustRequest, current_user: dict = Depends(req
         user_id=current_user["id"]
     )
     await db.inventory_transactions.insert_one(tx.dict())
+    _invalidate_dashboard_cache()
     
     return {"message": "Inventory adjusted", "transaction_id": tx.id}
 
@@ -2958,20 +2990,68 @@ async def get_transactions(
 
 # ==================== SHOPIFY INTEGRATION ====================
 
-async def download_image_as_base64(url: str) -> Optional[str]:
-    """Download image and convert to base64"""
+async def _fetch_image_as_base64(session: aiohttp.ClientSession, url: str) -> Optional[str]:
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                if response.status == 200:
-                    image_data = await response.read()
-                    base64_data = base64.b64encode(image_data).decode('utf-8')
-                    content_type = response.headers.get('content-type', 'image/jpeg')
-                    return f"data:{content_type};base64,{base64_data}"
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as response:
+            if response.status == 200:
+                image_data = await response.read()
+                base64_data = base64.b64encode(image_data).decode('utf-8')
+                content_type = response.headers.get('content-type', 'image/jpeg')
+                return f"data:{content_type};base64,{base64_data}"
     except Exception as e:
         logger.error(f"Error downloading image: {e}")
     return None
 
+async def download_images_as_base64(urls: List[str], concurrency: int = 8) -> Dict[str, Optional[str]]:
+    """Download several images concurrently over one session (url -> data URL)."""
+    unique_urls = list(dict.fromkeys(u for u in urls if u))
+    if not unique_urls:
+        return {}
+    sem = asyncio.Semaphore(concurrency)
+
+    async def fetch(session: aiohttp.ClientSession, url: str) -> Optional[str]:
+        async with sem:
+            return await _fetch_image_as_base64(session, url)
+
+    async with aiohttp.ClientSession() as session:
+        results = await asyncio.gather(*(fetch(session, u) for u in unique_urls))
+    return dict(zip(unique_urls, results))
+
+def _product_image_hash(image_base64: Optional[str]) -> Optional[str]:
+    """sha256 of the decoded image bytes, used to detect image changes on sync."""
+    if not image_base64:
+        return None
+    try:
+        raw = base64.b64decode(_strip_data_url_prefix(image_base64))
+    except Exception:
+        return None
+    return hashlib.sha256(raw).hexdigest()
+
+def _shopify_product_signature(title: str, handle: Optional[str], tags: List[str], image_url: Optional[str], variants: List[dict]) -> str:
+    """Stable hash of the Shopify-sourced product fields, used to skip no-op sync writes."""
+    payload = [
+        title,
+        handle,
+        tags,
+        image_url,
+        sorted(
+            [
+                v.get("shopify_variant_id"),
+                v.get("title"),
+                v.get("sku"),
+                v.get("barcode"),
+                v.get("upc_backup"),
+                v.get("price"),
+                v.get("inventory_item_id"),
+                v.get("inventory_management"),
+                v.get("inventory_quantity"),
+            ]
+            for v in variants
+        ),
+    ]
+    raw = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
 # ==================== IMAGE HELPERS (Local -> Shopify) ====================
 def _strip_data_url_prefix(data_url: str) -> str:
     if not data_url:
@@ -3027,7 +3107,13 @@ def _prepare_shopify_image_attachment(
         logger.error(f"Image prepare failed: {exc}")
         return None
 
+# Shopify warehouse location per (shop_domain, api_version); static for a shop
+_shopify_location_cache: Dict[tuple, int] = {}
+
 async def _get_shopify_primary_location_id(shop_domain: str, access_token: str, api_version: str) -> Optional[int]:
+    cache_key = (shop_domain, api_version)
+    if cache_key in _shopify_location_cache:
+        return _shopify_location_cache[cache_key]
     headers = {
         "X-Shopify-Access-Token": access_token,
         "Content-Type": "application/json"
@@ -3045,6 +3131,8 @@ async def _get_shopify_primary_location_id(shop_domain: str, access_token: str,
                 break
         if not warehouse_location_id and shopify_locations:
             warehouse_location_id = shopify_locations[0]["id"]
+        if warehouse_location_id:
+            _shopify_location_cache[cache_key] = warehouse_location_id
         return warehouse_location_id
 
 async def _match_shopify_variant_for_local(product: dict, variant: dict) -> Optional[dict]:
@@ -3078,6 +3166,153 @@ async def _match_shopify_variant_for_local(product: dict, variant: dict) -> Opti
             return {"product": match, "variant": v}
     return None
 
+SHOPIFY_BULK_PRODUCTS_QUERY = """
+{
+  products(query: "status:active") {
+    edges {
+      node {
+        id
+        title
+        handle
+        tags
+        featuredImage { url }
+        variants {
+          edges {
+            node {
+              id
+              title
+              sku
+              barcode
+              price
+              inventoryQuantity
+              inventoryItem { id tracked }
+              metafield(namespace: "%s", key: "%s") { value }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+# Upper bound for waiting on a bulk export before the sync gives up (and releases its lock)
+SHOPIFY_BULK_MAX_WAIT_SECONDS = 30 * 60
+
+def _shopify_gid_to_id(gid: Optional[str]) -> Optional[str]:
+    if not gid:
+        return None
+    return gid.rsplit("/", 1)[-1]
+
+async def _shopify_graphql(client: httpx.AsyncClient, gql_url: str, headers: dict, query: str, variables: Optional[dict] = None) -> dict:
+    for attempt in range(5):
+        resp = await client.post(gql_url, headers=headers, json={"query": query, "variables": variables or {}})
+        if resp.status_code in (429, 500, 502, 503, 504):
+            await asyncio.sleep(1.2 * (2 ** attempt))
+            continue
+        if resp.status_code != 200:
+            raise RuntimeError(f"Shopify GraphQL error: {resp.text}")
+        data = orjson.loads(resp.content)
+        if data.get("errors"):
+            raise RuntimeError(f"Shopify GraphQL error: {data['errors']}")
+        return data.get("data") or {}
+    raise RuntimeError("Shopify GraphQL error: too many retries")
+
+async def _shopify_bulk_fetch_products(client: httpx.AsyncClient, shop_domain: str, api_version: str, headers: dict) -> List[dict]:
+    """Export all active products with a GraphQL bulk operation.
+
+    Returns products shaped like the REST products.json payload so the sync
+    loop can consume them unchanged (variants carry `upc_backup` too).
+    """
+    gql_url = f"https://{shop_domain}/admin/api/{api_version}/graphql.json"
+    bulk_query = SHOPIFY_BULK_PRODUCTS_QUERY % (UPC_BACKUP_NAMESPACE, UPC_BACKUP_KEY)
+    mutation = """
+    mutation($query: String!) {
+      bulkOperationRunQuery(query: $query) {
+        bulkOperation { id status }
+        userErrors { field message }
+      }
+    }
+    """
+    data = await _shopify_graphql(client, gql_url, headers, mutation, {"query": bulk_query})
+    run = data.get("bulkOperationRunQuery") or {}
+    if run.get("userErrors"):
+        raise RuntimeError(f"Shopify bulk operation error: {run['userErrors']}")
+    op_id = (run.get("bulkOperation") or {}).get("id")
+    if not op_id:
+        raise RuntimeError("Shopify bulk operation error: no operation started")
+
+    status_query = "{ currentBulkOperation { id status errorCode objectCount url } }"
+    url = None
+    deadline = time.monotonic() + SHOPIFY_BULK_MAX_WAIT_SECONDS
+    last_seen = None
+    while True:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Shopify bulk operation {op_id} timed out after {SHOPIFY_BULK_MAX_WAIT_SECONDS}s")
+        await asyncio.sleep(2)
+        data = await _shopify_graphql(client, gql_url, headers, status_query)
+        op = data.get("currentBulkOperation")
+        if not op:
+            raise RuntimeError(f"Shopify bulk operation {op_id} not found")
+        if op.get("id") != op_id:
+            raise RuntimeError(f"Shopify bulk operation {op_id} was replaced by {op.get('id')}")
+        # Only real progress refreshes last_progress_at, so the stale-sync check can still fire
+        progress = (op.get("status"), op.get("objectCount"))
+        if progress != last_seen:
+            last_seen = progress
+            await db.shopify_sync_state.update_one({}, {"$set": {"last_progress_at": datetime.utcnow()}}, upsert=True)
+        if op.get("status") == "COMPLETED":
+            url = op.get("url")
+            break
+        if op.get("status") in ("FAILED", "CANCELED", "CANCELING", "EXPIRED"):
+            raise RuntimeError(f"Shopify bulk operation {op.get('status')}: {op.get('errorCode')}")
+
+    if not url:
+        # Completed with no objects (empty catalog)
+        return []
+
+    products: Dict[str, dict] = {}
+
+    async with client.stream("GET", url) as resp:
+        if resp.status_code != 200:
+            raise RuntimeError(f"Shopify bulk download error: {resp.status_code}")
+        async for line in resp.aiter_lines():
+            if not line.strip():
+                continue
+            node = orjson.loads(line)
+            parent_gid = node.get("__parentId")
+            if parent_gid is None:
+                image = node.get("featuredImage") or {}
+                products[node["id"]] = {
+                    "id": _shopify_gid_to_id(node["id"]),
+                    "title": node.get("title"),
+                    "handle": node.get("handle"),
+                    "tags": ", ".join(node.get("tags") or []),
+                    "images": [{"src": image["url"]}] if image.get("url") else [],
+                    "variants": [],
+                }
+                continue
+            product = products.get(parent_gid)
+            if product is None:
+                continue
+            inventory_item = node.get("inventoryItem") or {}
+            metafield = node.get("metafield") or {}
+            upc_backup = None
+            if metafield.get("value") is not None:
+                upc_backup = re.sub(r"\D+", "", str(metafield["value"])) or str(metafield["value"]).strip()
+            product["variants"].append({
+                "id": _shopify_gid_to_id(node.get("id")),
+                "title": node.get("title"),
+                "sku": node.get("sku"),
+                "barcode": node.get("barcode"),
+                "price": node.get("price"),
+                "inventory_item_id": _shopify_gid_to_id(inventory_item.get("id")),
+                "inventory_management": "shopify" if inventory_item.get("tracked") else None,
+                "inventory_quantity": node.get("inventoryQuantity"),
+                "upc_backup": upc_backup,
+            })
+    return list(products.values())
+
 @api_router.post("/shopify/sync")
 async def sync_shopify_products(current_user: dict = Depends(require_admin)):
     """AGGIORNA TUTTI I PRODOTTI - Avvia sync in background (READ ONLY)"""
@@ -3130,181 +3365,140 @@ async def run_shopify_sync(mode: str, current_user: dict):
                 async for product in db.products.find({"shopify_product_id": {"$exists": True}}, {"shopify_product_id": 1}):
                     existing_ids.add(product["shopify_product_id"])
 
-            next_page_url = f"https://{shop_domain}/admin/api/{api_version}/products.json?limit=50&status=active"
-
+            # Whole catalog in one bulk operation (no REST paging / per-item rate limits)
             async with httpx.AsyncClient(timeout=120.0) as client:
-                while next_page_url:
-                    response = await client.get(next_page_url, headers=headers)
-                    if response.status_code != 200:
-                        raise RuntimeError(f"Shopify API error: {response.text}")
-
-                    data = response.json()
-                    products = data.get("products", [])
-
-                    async def fetch_variant_upc_backup_map(product_id: str) -> dict[str, str]:
-                        """Fetch UPC backup metafield for all variants in a product via GraphQL (batched)."""
-                        gql_url = f"https://{shop_domain}/admin/api/{api_version}/graphql.json"
-                        query = """
-                        query($id: ID!, $cursor: String, $ns: String!, $key: String!) {
-                          product(id: $id) {
-                            variants(first: 100, after: $cursor) {
-                              edges {
-                                cursor
-                                node {
-                                  id
-                                  metafield(namespace: $ns, key: $key) { value }
-                                }
-                              }
-                              pageInfo { hasNextPage }
-                            }
-                          }
-                        }
-                        """
-                        out: dict[str, str] = {}
-                        cursor = None
-                        for attempt in range(6):
-                            try:
-                                while True:
-                                    variables = {
-                                        "id": f"gid://shopify/Product/{product_id}",
-                                        "cursor": cursor,
-                                        "ns": UPC_BACKUP_NAMESPACE,
-                                        "key": UPC_BACKUP_KEY,
-                                    }
-                                    gresp = await client.post(gql_url, headers=headers, json={"query": query, "variables": variables})
-                                    if gresp.status_code in (429, 500, 502, 503, 504):
-                                        await asyncio.sleep(1.2 * (2 ** attempt))
-                                        continue
-                                    data = gresp.json() if gresp.status_code == 200 else None
-                                    if not data or data.get("errors"):
-                                        # throttle or other error
-                                        await asyncio.sleep(1.2 * (2 ** attempt))
-                                        if attempt >= 5:
-                                            return out
-                                        break
-                                    product = (data.get("data") or {}).get("product") or {}
-                                    variants = (product.get("variants") or {})
-                                    edges = variants.get("edges") or []
-                                    for edge in edges:
-                                        node = edge.get("node") or {}
-                                        gid = node.get("id") or ""
-                                        # gid://shopify/ProductVariant/{id}
-                                        m = re.search(r"/ProductVariant/(\\d+)$", gid)
-                                        if not m:
-                                            continue
-                                        vid = m.group(1)
-                                        mf = node.get("metafield") or {}
-                                        val = mf.get("value")
-                                        if val is not None:
-                                            digits = re.sub(r"\\D+", "", str(val))
-                                            out[vid] = digits or str(val).strip()
-                                    if not variants.get("pageInfo", {}).get("hasNextPage"):
-                                        return out
-                                    cursor = edges[-1].get("cursor")
-                                    await asyncio.sleep(0.2)
-                            except Exception:
-                                await asyncio.sleep(1.2 * (2 ** attempt))
-                        return out
-
-                    async def fetch_variant_upc_backup_rest(variant_id: str) -> Optional[str]:
-                        """Fallback: fetch UPC backup metafield for a single variant via REST."""
-                        url = f"https://{shop_domain}/admin/api/{api_version}/variants/{variant_id}/metafields.json"
-                        for attempt in range(4):
-                            try:
-                                r = await client.get(url, headers=headers)
-                                if r.status_code in (429, 500, 502, 503, 504):
-                                    await asyncio.sleep(2.0 * (2 ** attempt))
-                                    continue
-                                if r.status_code != 200:
-                                    return None
-                                mfs = (r.json() or {}).get("metafields") or []
-                                for mf in mfs:
-                                    if mf.get("namespace") == UPC_BACKUP_NAMESPACE and mf.get("key") == UPC_BACKUP_KEY:
-                                        raw = mf.get("value")
-                                        if raw is None:
-                                            return None
-                                        digits = re.sub(r"\D+", "", str(raw))
-                                        return digits or str(raw).strip()
-                                return None
-                            except Exception:
-                                await asyncio.sleep(2.0 * (2 ** attempt))
-                            finally:
-                                # Shopify REST rate limit: keep under ~2 req/sec
-                                await asyncio.sleep(0.65)
-                        return None
-
-                    for shopify_product in products:
-                        shopify_id = str(shopify_product["id"])
-                        if mode == "new" and shopify_id in existing_ids:
-                            continue
-                        tags_raw = shopify_product.get("tags") or ""
-                        tags_list = [t.strip() for t in str(tags_raw).split(",") if t.strip()]
-
-                        # Get first image
-                        image_url = None
-                        image_base64 = None
-                        if shopify_product.get("images"):
-                            image_url = shopify_product["images"][0].get("src")
-                            if image_url:
-                                image_base64 = await download_image_as_base64(image_url)
-
-                        # Create variants + fetch UPC backup metafields (batched GraphQL)
-                        upc_backup_map = await fetch_variant_upc_backup_map(shopify_id)
-
-                        # Create variants
-                        variants = []
-                        for shopify_variant in shopify_product.get("variants", []):
-                            v_id = str(shopify_variant.get("id"))
-                            upc_backup = upc_backup_map.get(v_id)
-                            if not upc_backup:
-                                upc_backup = await fetch_variant_upc_backup_rest(v_id)
-                            variants.append({
-                              "id": str(uuid.uuid4()),
-                              "shopify_variant_id": v_id,
-                              "product_id": "",  # Will be set below
-                              "title": shopify_variant.get("title", "Default"),
-                              "sku": shopify_variant.get("sku"),
-                              "barcode": shopify_variant.get("barcode"),
-                              "upc_backup": upc_backup,
-                              "price": float(shopify_variant.get("price", 0)) if shopify_variant.get("price") else 0,
-                              "inventory_item_id": str(shopify_variant.get("inventory_item_id")) if shopify_variant.get("inventory_item_id") else None,
-                              "inventory_management": shopify_variant.get("inventory_management"),
-                              "inventory_quantity": shopify_variant.get("inventory_quantity"),
-                              "created_at": datetime.utcnow()
-                              })
-
-                        # Check if product exists
-                        existing = await db.products.find_one({"shopify_product_id": shopify_id})
+                products = await _shopify_bulk_fetch_products(client, shop_domain, api_version, headers)
+
+            if mode == "new":
+                products = [p for p in products if str(p["id"]) not in existing_ids]
+
+            def first_image_url(shopify_product: dict) -> Optional[str]:
+                images = shopify_product.get("images") or []
+                return images[0].get("src") if images else None
+
+            def build_variants(shopify_product: dict) -> List[dict]:
+                # UPC backup metafield comes with the bulk export
+                return [
+                    {
+                        "id": str(uuid.uuid4()),
+                        "shopify_variant_id": str(shopify_variant.get("id")),
+                        "product_id": "",  # Will be set below
+                        "title": shopify_variant.get("title", "Default"),
+                        "sku": shopify_variant.get("sku"),
+                        "barcode": shopify_variant.get("barcode"),
+                        "upc_backup": shopify_variant.get("upc_backup"),
+                        "price": float(shopify_variant.get("price", 0)) if shopify_variant.get("price") else 0,
+                        "inventory_item_id": str(shopify_variant.get("inventory_item_id")) if shopify_variant.get("inventory_item_id") else None,
+                        "inventory_management": shopify_variant.get("inventory_management"),
+                        "inventory_quantity": shopify_variant.get("inventory_quantity"),
+                        "created_at": datetime.utcnow()
+                    }
+                    for shopify_variant in shopify_product.get("variants", [])
+                ]
+
+            # Existing products are looked up without their (large) inline image
+            existing_projection = {
+                "_id": 0,
+                "id": 1,
+                "shopify_product_id": 1,
+                "variants": 1,
+                "content_hash": 1,
+                "image_url": 1,
+                "image_hash": 1,
+                "has_image_base64": {"$eq": [{"$type": "$image_base64"}, "string"]},
+            }
+
+            # Products are handled in batches: signatures are compared first, and images are
+            # downloaded only for written products whose image_url changed (or have no image yet)
+            batch_size = 50
+            for batch_start in range(0, len(products), batch_size):
+                batch = []
+                for shopify_product in products[batch_start:batch_start + batch_size]:
+                    tags_raw = shopify_product.get("tags") or ""
+                    tags_list = [t.strip() for t in str(tags_raw).split(",") if t.strip()]
+                    image_url = first_image_url(shopify_product)
+                    variants = build_variants(shopify_product)
+                    content_hash = _shopify_product_signature(
+                        shopify_product["title"],
+                        shopify_product.get("handle"),
+                        tags_list,
+                        image_url,
+                        variants,
+                    )
+                    batch.append((shopify_product, str(shopify_product["id"]), tags_list, image_url, variants, content_hash))
+
+                existing_by_shopify_id = {
+                    doc["shopify_product_id"]: doc
+                    async for doc in db.products.find(
+                        {"shopify_product_id": {"$in": [item[1] for item in batch]}},
+                        existing_projection
+                    )
+                }
+
+                def needs_write(shopify_id: str, content_hash: str) -> bool:
+                    existing = existing_by_shopify_id.get(shopify_id)
+                    if not existing:
+                        return True
+                    return mode != "new" and existing.get("content_hash") != content_hash
+
+                def needs_image(shopify_id: str, image_url: Optional[str]) -> bool:
+                    existing = existing_by_shopify_id.get(shopify_id)
+                    if not existing:
+                        return True
+                    return existing.get("image_url") != image_url or not existing.get("has_image_base64")
+
+                images_by_url = await download_images_as_base64([
+                    image_url for _, shopify_id, _, image_url, _, content_hash in batch
+                    if image_url and needs_write(shopify_id, content_hash) and needs_image(shopify_id, image_url)
+                ])
+
+                for shopify_product, shopify_id, tags_list, image_url, variants, content_hash in batch:
+                    existing = existing_by_shopify_id.get(shopify_id)
+                    if needs_write(shopify_id, content_hash):
+                        image_base64 = images_by_url.get(image_url) if image_url else None
+                        image_hash = _product_image_hash(image_base64)
+                        # A failed download leaves the sync incomplete for this product: the
+                        # signature is not recorded, so the next sync retries the image
+                        image_failed = bool(image_url) and image_base64 is None
 
                         if existing and mode != "new":
                             # Update existing product - KEEP existing variant IDs for inventory tracking
                             existing_variants = {v.get("shopify_variant_id"): v for v in existing.get("variants", [])}
+                            updated_variants = [
+                                {
+                                    **new_v,
+                                    "id": old_v.get("id") or new_v["id"],
+                                    "product_id": existing["id"],
+                                    "upc_backup": new_v.get("upc_backup") or old_v.get("upc_backup"),
+                                }
+                                for new_v, old_v in (
+                                    (nv, existing_variants.get(nv["shopify_variant_id"], {})) for nv in variants
+                                )
+                            ]
 
-                            updated_variants = []
-                            for new_v in variants:
-                                shopify_vid = new_v["shopify_variant_id"]
-                                if shopify_vid in existing_variants:
-                                    # Keep existing ID, update other fields
-                                    old_v = existing_variants[shopify_vid]
-                                    new_v["id"] = old_v["id"]
-                                    new_v["product_id"] = existing["id"]
-                                    if not new_v.get("upc_backup") and old_v.get("upc_backup"):
-                                        new_v["upc_backup"] = old_v.get("upc_backup")
-                                else:
-                                    new_v["product_id"] = existing["id"]
-                                updated_variants.append(new_v)
-
+                            update_fields = {
+                                "title": shopify_product["title"],
+                                "handle": shopify_product.get("handle"),
+                                "tags": tags_list,
+                                "variants": updated_variants,
+                                "updated_at": datetime.utcnow()
+                            }
+                            if not needs_image(shopify_id, image_url):
+                                # Same image_url and image already stored: reuse it
+                                update_fields["content_hash"] = content_hash
+                            elif image_failed:
+                                # Keep the stored image (and image_url) until a download succeeds
+                                pass
+                            else:
+                                update_fields["image_url"] = image_url
+                                update_fields["image_hash"] = image_hash
+                                update_fields["content_hash"] = content_hash
+                                # Only rewrite the (large) inline image when its content changed
+                                if existing.get("image_hash") != image_hash or not existing.get("has_image_base64"):
+                                    update_fields["image_base64"] = image_base64
                             await db.products.update_one(
                                 {"id": existing["id"]},
-                                {"$set": {
-                                    "title": shopify_product["title"],
-                                    "handle": shopify_product.get("handle"),
-                                    "tags": tags_list,
-                                    "image_url": image_url,
-                                    "image_base64": image_base64,
-                                    "variants": updated_variants,
-                                    "updated_at": datetime.utcnow()
-                                }}
+                                {"$set": update_fields}
                             )
                             products_updated += 1
                         elif not existing:
@@ -3321,38 +3515,30 @@ async def run_shopify_sync(mode: str, current_user: dict):
                                 "tags": tags_list,
                                 "image_url": image_url,
                                 "image_base64": image_base64,
+                                "image_hash": image_hash,
                                 "variants": variants,
+                                "content_hash": None if image_failed else content_hash,
                                 "created_at": datetime.utcnow(),
                                 "updated_at": datetime.utcnow(),
                                 "is_active": True
                             }
                             await db.products.insert_one(product)
                             existing_ids.add(shopify_id)
+                            existing_by_shopify_id[shopify_id] = {**product, "has_image_base64": image_base64 is not None}
                             products_created += 1
 
-                        products_synced += 1
-                        # Throttle between products to avoid Shopify API rate limits
-                        await asyncio.sleep(0.4)
-
-                    await db.shopify_sync_state.update_one(
-                        {},
-                        {"$set": {
-                            "products_synced": products_synced,
-                            "products_created": products_created,
-                            "products_updated": products_updated,
-                            "last_progress_at": datetime.utcnow()
-                        }},
-                        upsert=True
-                    )
-
-                    # Check for next page
-                    next_page_url = None
-                    link_header = response.headers.get("Link", "")
-                    if 'rel="next"' in link_header:
-                        for part in link_header.split(","):
-                            if 'rel="next"' in part:
-                                next_page_url = part.split(";")[0].strip().strip("<>")
-                                break
+                    products_synced += 1
+                    if products_synced % 50 == 0:
+                        await db.shopify_sync_state.update_one(
+                            {},
+                            {"$set": {
+                                "products_synced": products_synced,
+                                "products_created": products_created,
+                                "products_updated": products_updated,
+                                "last_progress_at": datetime.utcnow()
+                            }},
+                            upsert=True
+                        )
 
             completed_at = datetime.utcnow()
             await db.shopify_sync_state.update_one(
@@ -3368,6 +3554,7 @@ async def run_shopify_sync(mode: str, current_user: dict):
                 }},
                 upsert=True
             )
+            _invalidate_dashboard_cache()
             await log_system_event(
                 "info",
                 "Shopify sync completed",
@@ -3457,7 +3644,7 @@ async def sync_shopify_collections(current_user: dict = Depends(require_admin)):
             response = await client.get(custom_collections_url, headers=headers)
             
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 for shopify_coll in data.get("custom_collections", []):
                     # Get products in collection
                     collects_url = f"https://{shop_domain}/admin/api/2024-01/collects.json?collection_id={shopify_coll['id']}&limit=250"
@@ -3465,7 +3652,7 @@ async def sync_shopify_collections(current_user: dict = Depends(require_admin)):
                     
                     product_ids = []
                     if collects_resp.status_code == 200:
-                        collects_data = collects_resp.json()
+                        collects_data = orjson.loads(collects_resp.content)
                         shopify_product_ids = [str(c["product_id"]) for c in collects_data.get("collects", [])]
                         
                         # Map to our product IDs
@@ -3501,7 +3688,7 @@ async def sync_shopify_collections(current_user: dict = Depends(require_admin)):
             response = await client.get(smart_collections_url, headers=headers)
             
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 for shopify_coll in data.get("smart_collections", []):
                     # Get products in collection
                     products_url = f"https://{shop_domain}/admin/api/2024-01/collections/{shopify_coll['id']}/products.json?limit=250"
@@ -3509,7 +3696,7 @@ async def sync_shopify_collections(current_user: dict = Depends(require_admin)):
                     
                     product_ids = []
                     if products_resp.status_code == 200:
-                        products_data = products_resp.json()
+                        products_data = orjson.loads(products_resp.content)
                         for p in products_data.get("products", []):
                             product = await db.products.find_one({"shopify_product_id": str(p["id"])})
                             if product:
@@ -3548,15 +3735,30 @@ async def sync_shopify_collections(current_user: dict = Depends(require_admin)):
 # Global variable to track running sync task
 inventory_sync_task = None
 
+# In-process mirror of the inventory_sync_status document (polled by the UI)
+_sync_status_cache: dict = {}
+
+async def _update_inventory_sync_status(fields: dict):
+    """Update inventory_sync_status in Mongo and keep the in-process mirror in sync."""
+    await db.inventory_sync_status.update_one({}, {"$set": fields}, upsert=True)
+    if _sync_status_cache:
+        _sync_status_cache.update(fields)
+    else:
+        _sync_status_cache.update(await db.inventory_sync_status.find_one({}, {"_id": 0}) or {})
+
+async def _get_inventory_sync_status_doc() -> Optional[dict]:
+    if _sync_status_cache:
+        return dict(_sync_status_cache)
+    status = await db.inventory_sync_status.find_one({}, {"_id": 0})
+    if status:
+        _sync_status_cache.update(status)
+    return status
+
 async def background_inventory_sync(user_id: str, username: str):
     """Background task to sync inventory from Shopify with rate limiting"""
     shop_domain, access_token, api_version = get_shopify_config()
     if not shop_domain or not access_token:
-        await db.inventory_sync_status.update_one(
-            {},
-            {"$set": {"status": "error", "error_message": "Shopify credentials not configured"}},
-            upsert=True
-        )
+        await _update_inventory_sync_status({"status": "error", "error_message": "Shopify credentials not configured"})
         await log_system_event("error", "Inventory sync failed: missing Shopify credentials")
         return
     
@@ -3567,21 +3769,17 @@ async def background_inventory_sync(user_id: str, username: str):
         }
         
         # Update status: starting
-        await db.inventory_sync_status.update_one(
-            {},
-            {"$set": {
-                "status": "running",
-                "started_at": datetime.utcnow(),
-                "started_by": username,
-                "progress": 0,
-                "total_variants": 0,
-                "processed_variants": 0,
-                "imported_count": 0,
-                "error_message": None,
-                "estimated_time_remaining": None
-            }},
-            upsert=True
-        )
+        await _update_inventory_sync_status({
+            "status": "running",
+            "started_at": datetime.utcnow(),
+            "started_by": username,
+            "progress": 0,
+            "total_variants": 0,
+            "processed_variants": 0,
+            "imported_count": 0,
+            "error_message": None,
+            "estimated_time_remaining": None
+        })
         
         # Get Shopify locations
         async with httpx.AsyncClient(timeout=60.0) as client:
@@ -3633,25 +3831,18 @@ async def background_inventory_sync(user_id: str, username: str):
         total_variants = len(candidates)
 
         if total_variants == 0:
-            await db.inventory_sync_status.update_one(
-                {},
-                {"$set": {
-                    "status": "error",
-                    "error_message": "Nessuna variante con inventory tracciato. Sincronizza prima i prodotti da Shopify o abilita il tracking inventario.",
-                    "completed_at": datetime.utcnow()
-                }},
-                upsert=True
-            )
+            await _update_inventory_sync_status({
+                "status": "error",
+                "error_message": "Nessuna variante con inventory tracciato. Sincronizza prima i prodotti da Shopify o abilita il tracking inventario.",
+                "completed_at": datetime.utcnow()
+            })
             await log_system_event("warning", "Inventory sync skipped: no tracked variants")
             return
 
         # Delete only Shopify-sourced inventory to preserve local stock
         await db.inventory_levels.delete_many({"source": "shopify"})
         
-        await db.inventory_sync_status.update_one(
-            {},
-            {"$set": {"total_variants": total_variants}}
-        )
+        await _update_inventory_sync_status({"total_variants": total_variants})
         
         imported_count = 0
         processed_count = 0
@@ -3671,7 +3862,7 @@ async def background_inventory_sync(user_id: str, username: str):
                         inv_response = await client.get(inv_url, headers=headers)
 
                     if inv_response.status_code == 200:
-                        inv_levels = inv_response.json().get("inventory_levels", [])
+                        inv_levels = orjson.loads(inv_response.content).get("inventory_levels", [])
                         available_map = {str(x.get("inventory_item_id")): x.get("available", 0) for x in inv_levels}
                         for c in chunk:
                             available = available_map.get(c["inventory_item_id"], 0)
@@ -3701,15 +3892,12 @@ async def background_inventory_sync(user_id: str, username: str):
                     else:
                         eta_str = "Calcolo in corso..."
 
-                    await db.inventory_sync_status.update_one(
-                        {},
-                        {"$set": {
-                            "progress": progress,
-                            "processed_variants": processed_count,
-                            "imported_count": imported_count,
-                            "estimated_time_remaining": eta_str
-                        }}
-                    )
+                    await _update_inventory_sync_status({
+                        "progress": progress,
+                        "processed_variants": processed_count,
+                        "imported_count": imported_count,
+                        "estimated_time_remaining": eta_str
+                    })
 
                     await asyncio.sleep(0.2)
 
@@ -3719,30 +3907,24 @@ async def background_inventory_sync(user_id: str, username: str):
                     continue
         
         # Sync completed
-        await db.inventory_sync_status.update_one(
-            {},
-            {"$set": {
-                "status": "completed",
-                "completed_at": datetime.utcnow(),
-                "progress": 100,
-                "processed_variants": processed_count,
-                "imported_count": imported_count,
-                "estimated_time_remaining": None
-            }}
-        )
+        await _update_inventory_sync_status({
+            "status": "completed",
+            "completed_at": datetime.utcnow(),
+            "progress": 100,
+            "processed_variants": processed_count,
+            "imported_count": imported_count,
+            "estimated_time_remaining": None
+        })
         
         logger.info(f"Inventory sync completed: {imported_count} items imported")
         
     except Exception as e:
         logger.error(f"Inventory sync error: {e}")
-        await db.inventory_sync_status.update_one(
-            {},
-            {"$set": {
-                "status": "error",
-                "error_message": str(e),
-                "completed_at": datetime.utcnow()
-            }}
-        )
+        await _update_inventory_sync_status({
+            "status": "error",
+            "error_message": str(e),
+            "completed_at": datetime.utcnow()
+        })
 
 @api_router.post("/shopify/sync-inventory")
 async def start_inventory_sync(background_tasks: BackgroundTasks, current_user: dict = Depends(require_admin)):
@@ -3750,7 +3932,7 @@ async def start_inventory_sync(background_tasks: BackgroundTasks, current_user:
     global inventory_sync_task
     
     # Check if sync is already running
-    status = await db.inventory_sync_status.find_one({}, {"_id": 0})
+    status = await _get_inventory_sync_status_doc()
     if status and status.get("status") == "running":
         return {
             "message": "Sincronizzazione già in corso",
@@ -3775,7 +3957,7 @@ async def start_inventory_sync(background_tasks: BackgroundTasks, current_user:
 @api_router.get("/shopify/inventory-sync-status")
 async def get_inventory_sync_status(current_user: dict = Depends(get_current_user)):
     """Get current inventory sync status"""
-    status = await db.inventory_sync_status.find_one({}, {"_id": 0})
+    status = await _get_inventory_sync_status_doc()
     if not status:
         return {
             "status": "never_started",
@@ -3787,10 +3969,7 @@ async def get_inventory_sync_status(current_user: dict = Depends(get_current_use
 @api_router.post("/shopify/sync-inventory/stop")
 async def stop_inventory_sync(current_user: dict = Depends(require_admin)):
     """Stop running inventory sync"""
-    await db.inventory_sync_status.update_one(
-        {},
-        {"$set": {"status": "stopped", "completed_at": datetime.utcnow()}}
-    )
+    await _update_inventory_sync_status({"status": "stopped", "completed_at": datetime.utcnow()})
     return {"message": "Sincronizzazione interrotta"}
 
 @api_router.get("/shopify/orders/pending")
@@ -3815,18 +3994,31 @@ async def get_pending_shopify_orders(current_user: dict = Depends(get_current_us
             if response.status_code != 200:
                 raise HTTPException(status_code=500, detail="Failed to get Shopify orders")
             
-            orders = response.json().get("orders", [])
+            orders = orjson.loads(response.content).get("orders", [])
+
+            # Find our local products for all line items in one query
+            shopify_product_ids = list({
+                str(item.get("product_id"))
+                for order in orders
+                for item in order.get("line_items", [])
+            })
+            products_by_shopify_id = {}
+            async for p in db.products.find(
+                {"shopify_product_id": {"$in": shopify_product_ids}},
+                {"_id": 0, "id": 1, "shopify_product_id": 1, "variants": 1, "image_base64": 1}
+            ):
+                # Keep the first match, as find_one did
+                products_by_shopify_id.setdefault(p["shopify_product_id"], p)
             
             # Format orders for frontend
             pending_orders = []
             for order in orders:
+                customer = order.get("customer") or {}
+                shipping_address = order.get("shipping_address") or {}
                 order_items = []
                 for item in order.get("line_items", []):
                     # Find our local product/variant
-                    product = await db.products.find_one(
-                        {"shopify_product_id": str(item.get("product_id"))},
-                        {"_id": 0}
-                    )
+                    product = products_by_shopify_id.get(str(item.get("product_id")))
                     
                     variant_info = None
                     if product:
@@ -3859,10 +4051,10 @@ async def get_pending_shopify_orders(current_user: dict = Depends(get_current_us
                     "currency": order.get("currency"),
                     "fulfillment_status": order.get("fulfillment_status"),
                     "customer": {
-                        "name": f"{order.get('customer', {}).get('first_name', '')} {order.get('customer', {}).get('last_name', '')}".strip(),
-                        "email": order.get("customer", {}).get("email")
+                        "name": f"{customer.get('first_name') or ''} {customer.get('last_name') or ''}".strip(),
+                        "email": customer.get("email")
                     },
-                    "shipping_address": order.get("shipping_address", {}),
+                    "shipping_address": shipping_address,
                     "items": order_items,
                     "items_count": len(order_items)
                 })
@@ -3908,115 +4100,188 @@ async def get_shipped_orders(skip: int = 0, limit: int = 50, current_user: dict
 
 # ==================== SHOPIFY INVENTORY UPDATE (when selling locally) ====================
 
-async def update_shopify_inventory(variant_id: str, quantity_change: int, current_user: dict):
-    """Update Shopify inventory when selling locally"""
+async def _resolve_shopify_inventory_item(
+    client: httpx.AsyncClient,
+    headers: dict,
+    shop_domain: str,
+    api_version: str,
+    variant_id: str,
+) -> Optional[dict]:
+    """Resolve the Shopify variant/inventory item behind a local variant (None if not syncable)."""
+    # Get variant's Shopify variant ID
+    product = await db.products.find_one({"variants.id": variant_id})
+    if not product:
+        return None
+    if any(str(t).strip().upper() == "NOGESTIONALE" for t in product.get("tags") or []):
+        logger.info(f"Skipping Shopify sync for variant {variant_id}: product tagged NOGESTIONALE")
+        return None
+    
+    shopify_variant_id = None
+    local_variant = None
+    for v in product.get("variants", []):
+        if v.get("id") == variant_id:
+            shopify_variant_id = v.get("shopify_variant_id")
+            local_variant = v
+            break
+    
+    if not shopify_variant_id:
+        # Try to auto-link local variant to Shopify by barcode/upc_backup/sku
+        if local_variant:
+            match = await _match_shopify_variant_for_local(product, local_variant)
+            if match:
+                shopify_product = match["product"]
+                shopify_variant = match["variant"]
+                shopify_variant_id = shopify_variant.get("shopify_variant_id")
+                local_variant = {**local_variant, "inventory_item_id": shopify_variant.get("inventory_item_id")}
+                # Update local product/variant link
+                await db.products.update_one(
+                    {"id": product.get("id"), "variants.id": variant_id},
+                    {"$set": {
+                        "shopify_product_id": shopify_product.get("shopify_product_id"),
+                        "updated_at": datetime.utcnow(),
+                        "variants.$.shopify_variant_id": shopify_variant_id,
+                        "variants.$.inventory_item_id": shopify_variant.get("inventory_item_id"),
+                        "variants.$.inventory_management": shopify_variant.get("inventory_management"),
+                        "variants.$.inventory_quantity": shopify_variant.get("inventory_quantity"),
+                    }}
+                )
+                logger.info(f"Auto-linked local variant {variant_id} to Shopify variant {shopify_variant_id}")
+            else:
+                logger.warning(f"No Shopify variant ID for variant {variant_id}")
+                return None
+        else:
+            logger.warning(f"No Shopify variant ID for variant {variant_id}")
+            return None
+    
+    # Inventory item ID is stored on the variant by the product sync; fetch only if missing
+    inventory_item_id = local_variant.get("inventory_item_id") if local_variant else None
+    if not inventory_item_id:
+        variant_url = f"https://{shop_domain}/admin/api/{api_version}/variants/{shopify_variant_id}.json"
+        var_response = await client.get(variant_url, headers=headers)
+        
+        if var_response.status_code != 200:
+            logger.error(f"Failed to get variant: {var_response.status_code}")
+            return None
+        
+        inventory_item_id = var_response.json().get("variant", {}).get("inventory_item_id")
+        
+        if not inventory_item_id:
+            return None
+        
+        await db.products.update_one(
+            {"variants.id": variant_id},
+            {"$set": {"variants.$.inventory_item_id": str(inventory_item_id)}}
+        )
+    
+    return {
+        "product": product,
+        "shopify_variant_id": shopify_variant_id,
+        "inventory_item_id": str(inventory_item_id),
+    }
+
+async def sync_shopify_inventory_batch(adjustments: List[dict], current_user: dict) -> Dict[str, bool]:
+    """Push several local quantity changes to Shopify with one inventoryAdjustQuantities call.
+
+    `adjustments` is a list of {"variant_id", "quantity_change"}; returns variant_id -> updated.
+    """
+    results = {a["variant_id"]: False for a in adjustments}
     shop_domain, access_token, api_version = get_shopify_config()
     
     if not shop_domain or not access_token:
         logger.warning("Shopify credentials not configured, skipping inventory update")
         await log_system_event("warning", "Skipping Shopify inventory update (missing credentials)")
-        return False
+        return results
+    
+    headers = {
+        "X-Shopify-Access-Token": access_token,
+        "Content-Type": "application/json"
+    }
     
     try:
-        # Get variant's Shopify variant ID
-        product = await db.products.find_one({"variants.id": variant_id})
-        if not product:
-            return False
-        product_tags = [str(t).strip().upper() for t in (product.get("tags") or []) if str(t).strip()]
-        if "NOGESTIONALE" in product_tags:
-            logger.info(f"Skipping Shopify sync for variant {variant_id}: product tagged NOGESTIONALE")
-            return False
-        
-        shopify_variant_id = None
-        local_variant = None
-        for v in product.get("variants", []):
-            if v.get("id") == variant_id:
-                shopify_variant_id = v.get("shopify_variant_id")
-                local_variant = v
-                break
-        
-        if not shopify_variant_id:
-            # Try to auto-link local variant to Shopify by barcode/upc_backup/sku
-            if local_variant:
-                match = await _match_shopify_variant_for_local(product, local_variant)
-                if match:
-                    shopify_product = match["product"]
-                    shopify_variant = match["variant"]
-                    shopify_variant_id = shopify_variant.get("shopify_variant_id")
-                    # Update local product/variant link
-                    await db.products.update_one(
-                        {"id": product.get("id"), "variants.id": variant_id},
-                        {"$set": {
-                            "shopify_product_id": shopify_product.get("shopify_product_id"),
-                            "updated_at": datetime.utcnow(),
-                            "variants.$.shopify_variant_id": shopify_variant_id,
-                            "variants.$.inventory_item_id": shopify_variant.get("inventory_item_id"),
-                            "variants.$.inventory_management": shopify_variant.get("inventory_management"),
-                            "variants.$.inventory_quantity": shopify_variant.get("inventory_quantity"),
-                        }}
-                    )
-                    logger.info(f"Auto-linked local variant {variant_id} to Shopify variant {shopify_variant_id}")
-                else:
-                    logger.warning(f"No Shopify variant ID for variant {variant_id}")
-                    return False
-            else:
-                logger.warning(f"No Shopify variant ID for variant {variant_id}")
-                return False
-        
-        headers = {
-            "X-Shopify-Access-Token": access_token,
-            "Content-Type": "application/json"
-        }
-        
         async with httpx.AsyncClient(timeout=30.0) as client:
-            # Get inventory item ID
-            variant_url = f"https://{shop_domain}/admin/api/{api_version}/variants/{shopify_variant_id}.json"
-            var_response = await client.get(variant_url, headers=headers)
-            
-            if var_response.status_code != 200:
-                logger.error(f"Failed to get variant: {var_response.status_code}")
-                return False
-            
-            inventory_item_id = var_response.json().get("variant", {}).get("inventory_item_id")
+            # Sum deltas per inventory item (the same variant may be adjusted twice)
+            deltas: Dict[str, int] = {}
+            targets: Dict[str, dict] = {}
+            for adj in adjustments:
+                variant_id = adj["variant_id"]
+                if variant_id not in targets:
+                    target = await _resolve_shopify_inventory_item(client, headers, shop_domain, api_version, variant_id)
+                    if not target:
+                        continue
+                    targets[variant_id] = target
+                item_id = targets[variant_id]["inventory_item_id"]
+                deltas[item_id] = deltas.get(item_id, 0) + int(adj["quantity_change"])
             
-            if not inventory_item_id:
-                return False
+            if not targets:
+                return results
             
             warehouse_location_id = await _get_shopify_primary_location_id(
                 shop_domain, access_token, api_version
             )
             if not warehouse_location_id:
-                return False
+                return results
             
-            # Adjust inventory on Shopify
-            adjust_url = f"https://{shop_domain}/admin/api/{api_version}/inventory_levels/adjust.json"
-            adjust_data = {
-                "location_id": warehouse_location_id,
-                "inventory_item_id": inventory_item_id,
-                "available_adjustment": quantity_change  # negative for sales
+            # Adjust inventory on Shopify (GraphQL accepts many changes per call)
+            gql_url = f"https://{shop_domain}/admin/api/{api_version}/graphql.json"
+            mutation = """
+            mutation($input: InventoryAdjustQuantitiesInput!) {
+              inventoryAdjustQuantities(input: $input) {
+                userErrors { field message }
+              }
             }
+            """
+            changes = [
+                {
+                    "inventoryItemId": f"gid://shopify/InventoryItem/{item_id}",
+                    "locationId": f"gid://shopify/Location/{warehouse_location_id}",
+                    "delta": delta,
+                }
+                for item_id, delta in deltas.items()
+                if delta
+            ]
+            failed_items = set()
+            for i in range(0, len(changes), 100):
+                chunk = changes[i:i + 100]
+                variables = {"input": {"reason": "correction", "name": "available", "changes": chunk}}
+                try:
+                    data = await _shopify_graphql(client, gql_url, headers, mutation, variables)
+                    user_errors = (data.get("inventoryAdjustQuantities") or {}).get("userErrors") or []
+                except RuntimeError as e:
+                    user_errors = [{"message": str(e)}]
+                if user_errors:
+                    logger.error(f"Failed to adjust Shopify inventory: {user_errors}")
+                    failed_items.update(_shopify_gid_to_id(c["inventoryItemId"]) for c in chunk)
             
-            adjust_response = await client.post(adjust_url, headers=headers, json=adjust_data)
-            
-            if adjust_response.status_code == 200:
-                logger.info(f"Updated Shopify inventory for variant {shopify_variant_id}: {quantity_change}")
+            for adj in adjustments:
+                variant_id = adj["variant_id"]
+                target = targets.get(variant_id)
+                if not target or target["inventory_item_id"] in failed_items:
+                    continue
+                results[variant_id] = True
+                quantity_change = adj["quantity_change"]
+                logger.info(f"Updated Shopify inventory for variant {target['shopify_variant_id']}: {quantity_change}")
                 
                 await log_action(
                     ActionType.SHOPIFY_UPDATE,
                     current_user,
-                    f"Updated Shopify inventory: {quantity_change} for {product.get('title')}",
+                    f"Updated Shopify inventory: {quantity_change} for {target['product'].get('title')}",
                     entity_type="shopify_inventory",
-                    metadata={"shopify_variant_id": shopify_variant_id, "adjustment": quantity_change}
+                    metadata={"shopify_variant_id": target["shopify_variant_id"], "adjustment": quantity_change}
                 )
-                
-                return True
-            else:
-                logger.error(f"Failed to adjust Shopify inventory: {adjust_response.text}")
-                return False
+            
+            return results
                 
     except Exception as e:
         logger.error(f"Error updating Shopify inventory: {e}")
-        return False
+        return results
+
+async def update_shopify_inventory(variant_id: str, quantity_change: int, current_user: dict):
+    """Update Shopify inventory when selling locally"""
+    results = await sync_shopify_inventory_batch(
+        [{"variant_id": variant_id, "quantity_change": quantity_change}],
+        current_user
+    )
+    return results.get(variant_id, False)
 
 # ==================== LOCAL PRODUCTS (non-Shopify) ====================
 
@@ -4108,13 +4373,13 @@ async def create_local_product(data: LocalProductCreate, current_user: dict = De
     }
 
 @api_router.get("/products/local")
-async def get_local_products(current_user: dict = Depends(get_current_user)):
+async def get_local_products(request: Request, current_user: dict = Depends(get_current_user)):
     """Get all local products (not from Shopify)"""
     products = await db.products.find(
         {"shopify_product_id": None, "is_active": True},
         {"_id": 0}
-    ).to_list(1000)
-    return products
+    ).batch_size(1000).to_list(1000)
+    return _etag_json_response(request, products)
 
 # ==================== SHOPIFY PUSH (Local -> Shopify) ====================
 
@@ -4332,31 +4597,23 @@ async def create_purchase_link(data: PurchaseLinkCreate, current_user: dict = De
 
 @api_router.get("/purchase-links")
 async def get_purchase_links(
+    request: Request,
     status: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
     """Get all purchase links (admin view)"""
+    # Expire overdue links in one write, so the listing below is already up to date
+    await db.purchase_links.update_many(
+        {"status": "pending", "expires_at": {"$lt": datetime.utcnow()}},
+        {"$set": {"status": "expired"}}
+    )
+
     query = {}
     if status:
         query["status"] = status
     
-    links = await db.purchase_links.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
-    
-    # Check and update expired links
-    now = datetime.utcnow()
-    for link in links:
-        if link.get("status") == "pending" and link.get("expires_at"):
-            expires = link["expires_at"]
-            if isinstance(expires, str):
-                expires = datetime.fromisoformat(expires.replace("Z", "+00:00"))
-            if expires < now:
-                await db.purchase_links.update_one(
-                    {"id": link["id"]},
-                    {"$set": {"status": "expired"}}
-                )
-                link["status"] = "expired"
-    
-    return links
+    links = await db.purchase_links.find(query, {"_id": 0}).sort("created_at", -1).limit(100).batch_size(100).to_list(100)
+    return _etag_json_response(request, links)
 
 @api_router.get("/purchase-links/{link_id}")
 async def get_purchase_link(link_id: str, current_user: dict = Depends(get_current_user)):
@@ -4406,7 +4663,7 @@ async def get_purchase_identity(identity_id: str, current_user: dict = Depends(r
 # PUBLIC ENDPOINTS (no auth required) for suppliers
 
 @api_router.get("/public/purchase/{token}")
-async def get_public_purchase_link(token: str):
+async def get_public_purchase_link(token: str, request: Request):
     """Public endpoint for supplier to view purchase details"""
     link = await db.purchase_links.find_one({"token": token}, {"_id": 0})
     
@@ -4415,24 +4672,29 @@ async def get_public_purchase_link(token: str):
     
     # Check expiration
     expires = link.get("expires_at")
-    if expires:
-        if isinstance(expires, str):
-            expires = datetime.fromisoformat(expires.replace("Z", "+00:00"))
-        if expires < datetime.utcnow():
-            return {"error": "Link scaduto", "expired": True}
+    # A leftover unparseable legacy value counts as expired rather than never expiring
+    if expires and (not isinstance(expires, datetime) or expires < datetime.utcnow()):
+        return {"error": "Link scaduto", "expired": True}
     
     if link.get("status") == "submitted":
         return {"error": "Questo link è già stato compilato", "already_submitted": True}
     
-    # Enrich items with product image when available
+    # Enrich items with product image when available (single query for all items)
+    items = link.get("items", [])
+    pids = list({it["product_id"] for it in items if it.get("product_id")})
+    img_map = {}
+    if pids:
+        products = await db.products.find(
+            {"id": {"$in": pids}},
+            {"_id": 0, "id": 1, "image_base64": 1, "image_url": 1}
+        ).to_list(len(pids))
+        img_map = {p["id"]: p.get("image_base64") or p.get("image_url") for p in products}
     enriched_items = []
-    for item in link.get("items", []):
+    for item in items:
         enriched = dict(item)
         product_id = item.get("product_id")
-        if product_id:
-            product = await db.products.find_one({"id": product_id}, {"_id": 0})
-            if product:
-                enriched["product_image"] = product.get("image_base64") or product.get("image_url")
+        if product_id and product_id in img_map:
+            enriched["product_image"] = img_map[product_id]
         enriched_items.append(enriched)
 
     identity_data = None
@@ -4442,7 +4704,7 @@ async def get_public_purchase_link(token: str):
             identity_data = identity["data"]
 
     # Return safe data for public view
-    return {
+    return _etag_json_response(request, {
         "id": link["id"],
         "items": enriched_items,
         "total_amount": link["total_amount"],
@@ -4452,7 +4714,7 @@ async def get_public_purchase_link(token: str):
         "status": link["status"],
         "doc_type": link.get("doc_type", "acquisto"),
         "identity": identity_data
-    }
+    })
 
 @api_router.post("/public/purchase/{token}/submit")
 async def submit_supplier_data(token: str, supplier_data: SupplierData):
@@ -4464,11 +4726,9 @@ async def submit_supplier_data(token: str, supplier_data: SupplierData):
     
     # Check expiration
     expires = link.get("expires_at")
-    if expires:
-        if isinstance(expires, str):
-            expires = datetime.fromisoformat(expires.replace("Z", "+00:00"))
-        if expires < datetime.utcnow():
-            raise HTTPException(status_code=400, detail="Link scaduto")
+    # A leftover unparseable legacy value counts as expired rather than never expiring
+    if expires and (not isinstance(expires, datetime) or expires < datetime.utcnow()):
+        raise HTTPException(status_code=400, detail="Link scaduto")
     
     if link.get("status") == "submitted":
         raise HTTPException(status_code=400, detail="Già compilato")
@@ -4544,76 +4804,85 @@ async def submit_supplier_data(token: str, supplier_data: SupplierData):
     
     return {"message": "Dati inviati con successo. Grazie!"}
 
-@api_router.get("/purchase-links/{link_id}/pdf")
-async def generate_purchase_pdf(
-    link_id: str,
-    token: Optional[str] = None,
-    current_user: dict = Depends(get_current_user_or_token)
-):
-    """Generate legal one-page PDF for private purchase or contovendita."""
-    from reportlab.lib.units import cm
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.utils import ImageReader
-
-    link = await db.purchase_links.find_one({"id": link_id})
-    if not link:
-        raise HTTPException(status_code=404, detail="Link non trovato")
-
-    if not link.get("supplier_data"):
-        raise HTTPException(status_code=400, detail="Dati fornitore non ancora compilati")
-
-    supplier = link["supplier_data"]
-
-    doc_type = (link.get("doc_type") or "acquisto").strip().lower()
-    if doc_type not in ("acquisto", "contovendita"):
-        doc_type = "acquisto"
+# Purchase PDF templates, read once at import (parsed per request from memory)
+def _read_pdf_template(filename: str) -> Optional[dict]:
+    path = ROOT_DIR / filename
+    if not path.exists():
+        return None
+    data = path.read_bytes()
+    mediabox = PdfReader(BytesIO(data)).pages[0].mediabox
+    return {"bytes": data, "w": float(mediabox.width), "h": float(mediabox.height)}
 
-    if doc_type == "contovendita":
-        template_path = ROOT_DIR / "CONTOVENDITAFOGLIO.pdf"
-        if not template_path.exists():
-            raise HTTPException(status_code=500, detail="Template CONTOVENDITAFOGLIO.pdf mancante")
-    else:
-        template_path = ROOT_DIR / "ACQUISTODAPRIVATO.pdf"
-        if not template_path.exists():
-            raise HTTPException(status_code=500, detail="Template ACQUISTODAPRIVATO.pdf mancante")
+PURCHASE_PDF_TEMPLATE_FILES = {
+    "acquisto": "ACQUISTODAPRIVATO.pdf",
+    "contovendita": "CONTOVENDITAFOGLIO.pdf",
+}
+_PURCHASE_PDF_TEMPLATES = {
+    doc_type: _read_pdf_template(filename) for doc_type, filename in PURCHASE_PDF_TEMPLATE_FILES.items()
+}
 
-    from pypdf import PdfReader, PdfWriter
-    from copy import deepcopy
+# SVG signature parsing (purchase PDF)
+_SIG_WS_RE = re.compile(r"\s+")
+_SIG_WIDTH_RE = re.compile(r'width="([\d\.]+)"')
+_SIG_HEIGHT_RE = re.compile(r'height="([\d\.]+)"')
+_SIG_PATH_D_RE = re.compile(r'd="([^"]+)"')
+_SIG_PATH_CMD_RE = re.compile(r'([ML])\s*([-\d\.]+)\s*([-\d\.]+)')
+
+def _fit_font_size(width: float, size: float, max_w: float, min_size: float = 14.0) -> float:
+    """Largest size (0.5pt steps down from `size`, not below `min_size`) at which text `width` wide at `size` fits `max_w`."""
+    if width <= max_w:
+        return size
+    # width scales linearly with size
+    return max(min_size, math.floor(size * max_w / width * 2) / 2)
+
+def _signature_segments(path: List[tuple], x: float, y: float, scale_x: float, scale_y: float, view_h: float) -> List[list]:
+    """Canvas line segments (x1, y1, x2, y2) for one parsed SVG path of (cmd, x, y) points."""
+    # 'L' points before the first 'M' have no start point and draw nothing
+    start = next((i for i, (cmd, _, _) in enumerate(path) if cmd == 'M'), len(path))
+    path = path[start:]
+    if len(path) < 2:
+        return []
+    pts = np.array([(px, py) for _, px, py in path], dtype=float)
+    xs = x + pts[:, 0] * scale_x
+    ys = y + (view_h - pts[:, 1]) * scale_y
+    # Segment i joins point i-1 to point i when point i is an 'L'
+    is_line = np.array([cmd == 'L' for cmd, _, _ in path[1:]], dtype=bool)
+    return np.column_stack((xs[:-1], ys[:-1], xs[1:], ys[1:]))[is_line].tolist()
+
+# Purchase PDFs are rendered off the event loop
+_pdf_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="purchase-pdf")
+
+def _build_purchase_pdf_bytes(link: dict, supplier: dict, doc_type: str, template: dict) -> bytes:
+    """Render the supplier overlay and merge it onto the template page (CPU-bound, runs in _pdf_pool)."""
+    from reportlab.pdfgen import canvas
 
-    tmpl_reader = PdfReader(str(template_path))
-    tmpl_page = tmpl_reader.pages[0]
-    page_w = float(tmpl_page.mediabox.width)
-    page_h = float(tmpl_page.mediabox.height)
+    page_w, page_h = template["w"], template["h"]
 
     def y_from_img(row_from_top: float, offset: float = 10.0) -> float:
         return page_h - row_from_top + offset
 
+    text_widths: Dict[tuple, float] = {}
+
     def draw_text_fit(c, text: str, x: float, y: float, max_w: float, font: str = "Helvetica", size: float = 24.0):
         t = (text or "").strip()
         if not t:
             return
-        c.setFont(font, size)
-        width = c.stringWidth(t, font, size)
-        if width <= max_w:
-            c.drawString(x, y, t)
-            return
-        # shrink to fit
-        min_size = 14.0
-        cur = size
-        while cur > min_size and c.stringWidth(t, font, cur) > max_w:
-            cur -= 0.5
-        c.setFont(font, cur)
+        key = (t, font, size)
+        width = text_widths.get(key)
+        if width is None:
+            width = text_widths[key] = c.stringWidth(t, font, size)
+        c.setFont(font, _fit_font_size(width, size, max_w))
         c.drawString(x, y, t)
 
     def parse_signature_paths(signature_value: str):
-        svg_xml = re.sub(r"\s+", " ", signature_value)
-        width_match = re.search(r'width="([\d\.]+)"', svg_xml)
-        height_match = re.search(r'height="([\d\.]+)"', svg_xml)
+        svg_xml = _SIG_WS_RE.sub(" ", signature_value)
+        width_match = _SIG_WIDTH_RE.search(svg_xml)
+        height_match = _SIG_HEIGHT_RE.search(svg_xml)
         view_w = float(width_match.group(1)) if width_match else 600.0
         view_h = float(height_match.group(1)) if height_match else 180.0
         paths = []
-        for d in re.findall(r'd="([^"]+)"', svg_xml):
-            tokens = re.findall(r'([ML])\s*([-\d\.]+)\s*([-\d\.]+)', d)
+        for d in _SIG_PATH_D_RE.findall(svg_xml):
+            tokens = _SIG_PATH_CMD_RE.findall(d)
             if tokens:
                 paths.append([(cmd, float(x), float(y)) for cmd, x, y in tokens])
         return paths, view_w, view_h
@@ -4632,15 +4901,9 @@ async def generate_purchase_pdf(
                 scale_y = h / view_h
                 c.setLineWidth(1)
                 for path in paths:
-                    last = None
-                    for cmd, px, py in path:
-                        dx = x + px * scale_x
-                        dy = y + (view_h - py) * scale_y
-                        if cmd == 'M':
-                            last = (dx, dy)
-                        elif cmd == 'L' and last:
-                            c.line(last[0], last[1], dx, dy)
-                            last = (dx, dy)
+                    segments = _signature_segments(path, x, y, scale_x, scale_y, view_h)
+                    if segments:
+                        c.lines(segments)
             elif str(signature_value).startswith("data:image"):
                 _, b64 = signature_value.split(",", 1)
                 img_bytes = base64.b64decode(b64)
@@ -4761,58 +5024,98 @@ async def generate_purchase_pdf(
     overlay.seek(0)
 
     # Merge overlay on top of template
+    tmpl_reader = PdfReader(BytesIO(template["bytes"]))
     overlay_reader = PdfReader(overlay)
     writer = PdfWriter()
-    base = deepcopy(tmpl_reader.pages[0])
+    # tmpl_reader is private to this request, so its page can be merged in place
+    base = tmpl_reader.pages[0]
     base.merge_page(overlay_reader.pages[0])
     writer.add_page(base)
 
     final_buffer = BytesIO()
     writer.write(final_buffer)
-    final_buffer.seek(0)
+    return final_buffer.getvalue()
+
+@api_router.get("/purchase-links/{link_id}/pdf")
+async def generate_purchase_pdf(
+    link_id: str,
+    token: Optional[str] = None,
+    current_user: dict = Depends(get_current_user_or_token)
+):
+    """Generate legal one-page PDF for private purchase or contovendita."""
+    link = await db.purchase_links.find_one({"id": link_id})
+    if not link:
+        raise HTTPException(status_code=404, detail="Link non trovato")
+
+    if not link.get("supplier_data"):
+        raise HTTPException(status_code=400, detail="Dati fornitore non ancora compilati")
+
+    supplier = link["supplier_data"]
+
+    doc_type = (link.get("doc_type") or "acquisto").strip().lower()
+    if doc_type not in ("acquisto", "contovendita"):
+        doc_type = "acquisto"
+
+    template = _PURCHASE_PDF_TEMPLATES.get(doc_type)
+    if template is None:
+        raise HTTPException(status_code=500, detail=f"Template {PURCHASE_PDF_TEMPLATE_FILES[doc_type]} mancante")
+
+    final_bytes = await asyncio.get_running_loop().run_in_executor(
+        _pdf_pool, _build_purchase_pdf_bytes, link, supplier, doc_type, template
+    )
 
     filename = f"acquisto_privato_{link_id[:8]}_{datetime.utcnow().strftime('%Y%m%d')}.pdf"
     return StreamingResponse(
-        final_buffer,
+        BytesIO(final_bytes),
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
-async def _build_inventory_export_rows(
+# Product fields needed to build inventory export rows (skips descriptions, tags, etc.)
+_EXPORT_PRODUCT_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "title": 1,
+    "image_base64": 1,
+    "image_url": 1,
+    "variants.id": 1,
+    "variants.title": 1,
+    "variants.barcode": 1,
+    "variants.upc_backup": 1,
+    "variants.sku": 1,
+    "variants.price": 1,
+}
+
+_EXPORT_CHUNK_SIZE = 1000
+
+async def _iter_inventory_export_rows(
     location_id: Optional[str],
     collection_product_ids: Optional[list],
     search: Optional[str] = None,
     size: Optional[str] = None,
     product_ids: Optional[list] = None,
     variant_ids: Optional[list] = None,
-):
-    inventory = await _get_inventory_levels_with_fallback(location_id)
-    rows = []
+) -> AsyncIterator[dict]:
+    """Yield inventory export rows as the Mongo cursor streams."""
     search_l = search.lower().strip() if search else None
     size_l = size.lower().strip() if size else None
-    for inv in inventory:
+
+    def build_row(inv: dict, product: Optional[dict], location: Optional[dict], shelf: Optional[dict]) -> Optional[dict]:
         try:
             qty = int(inv.get("quantity", 0))
         except (TypeError, ValueError):
             qty = 0
         if qty <= 0:
-            continue
-
-        product = await db.products.find_one({"variants.id": inv.get("variant_id")})
-        if not product and inv.get("product_id"):
-            product = await db.products.find_one({"id": inv.get("product_id")})
+            return None
 
         if collection_product_ids is not None:
             if not product or product.get("id") not in collection_product_ids:
-                continue
+                return None
 
         variant = None
         if product:
             variant = next((v for v in product.get("variants", []) if v.get("id") == inv.get("variant_id")), None)
 
-        location = await db.locations.find_one({"id": inv.get("location_id")})
-        shelf = await db.shelves.find_one({"id": inv.get("shelf_id")}) if inv.get("shelf_id") else None
-
         product_title = product.get("title") if product else inv.get("product_title") or f"Unknown ({inv.get('variant_id')})"
         variant_title = (variant.get("title") if variant else None) or inv.get("variant_title")
         barcode = (variant.get("barcode") if variant else None) or inv.get("variant_barcode")
@@ -4824,20 +5127,20 @@ async def _build_inventory_export_rows(
 
         if variant_ids is not None:
             if inv.get("variant_id") not in variant_ids:
-                continue
+                return None
         if product_ids is not None and (variant_ids is None):
             if product_id not in product_ids:
-                continue
+                return None
         if size_l:
             vt = (variant_title or "").lower()
             if size_l not in vt:
-                continue
+                return None
         if search_l:
             hay = f"{product_title} {variant_title or ''} {barcode or ''} {upc_backup or ''} {sku or ''}".lower()
             if search_l not in hay:
-                continue
+                return None
 
-        rows.append({
+        return {
             "product_id": product_id,
             "product_title": product_title,
             "variant_title": variant_title,
@@ -4849,11 +5152,124 @@ async def _build_inventory_export_rows(
             "shelf_name": shelf.get("name") if shelf else "",
             "quantity": qty,
             "product_image": product_image
-        })
+        }
+
+    # Locations/shelves are few and repeat across rows: memoize them for this export
+    name_cache: Dict[tuple, Optional[dict]] = {}
+
+    async def cached_by_id(collection, doc_id: Optional[str]) -> Optional[dict]:
+        if not doc_id:
+            return None
+        key = (collection.name, doc_id)
+        if key not in name_cache:
+            name_cache[key] = await collection.find_one({"id": doc_id}, {"_id": 0, "id": 1, "name": 1})
+        return name_cache[key]
+
+    async def rows_for_chunk(levels: List[dict]) -> AsyncIterator[dict]:
+        # One projected product query per chunk of inventory levels
+        variant_ids_needed = list({inv["variant_id"] for inv in levels if inv.get("variant_id")})
+        product_ids_needed = list({inv["product_id"] for inv in levels if inv.get("product_id")})
+        products = await db.products.find(
+            {"$or": [{"variants.id": {"$in": variant_ids_needed}}, {"id": {"$in": product_ids_needed}}]},
+            _EXPORT_PRODUCT_PROJECTION
+        ).to_list(None)
+        products_by_id: Dict[str, dict] = {}
+        products_by_variant: Dict[str, dict] = {}
+        for p in products:
+            products_by_id.setdefault(p.get("id"), p)
+            for v in p.get("variants", []):
+                products_by_variant.setdefault(v.get("id"), p)
+
+        for inv in levels:
+            product = products_by_variant.get(inv.get("variant_id"))
+            if not product and inv.get("product_id"):
+                product = products_by_id.get(inv.get("product_id"))
+            location = await cached_by_id(db.locations, inv.get("location_id"))
+            shelf = await cached_by_id(db.shelves, inv.get("shelf_id"))
+            row = build_row(inv, product, location, shelf)
+            if row:
+                yield row
+
+    # Stored inventory: stream the cursor and resolve products chunk by chunk; quantity,
+    # coverage and search/size rules stay in Python, as in build_row
+    query: Dict[str, Any] = {}
+    if location_id:
+        query["location_id"] = location_id
+    covered_variant_ids = set()
+    levels: List[dict] = []
+    async for inv in db.inventory_levels.find(query, {"_id": 0}).batch_size(_EXPORT_CHUNK_SIZE):
+        try:
+            qty = int(inv.get("quantity", 0))
+        except (TypeError, ValueError):
+            qty = 0
+        if qty <= 0:
+            continue
+        # Coverage comes from every stored level, including those build_row filters out
+        if inv.get("variant_id"):
+            covered_variant_ids.add(inv["variant_id"])
+        levels.append(inv)
+        if len(levels) >= _EXPORT_CHUNK_SIZE:
+            async for row in rows_for_chunk(levels):
+                yield row
+            levels = []
+    if levels:
+        async for row in rows_for_chunk(levels):
+            yield row
+
+    # Shopify fallback quantities for variants without stored inventory
+    fallback_location = await _get_fallback_location(location_id)
+    if fallback_location:
+        fallback_products = await db.products.find(
+            {"is_active": True, "variants.inventory_quantity": {"$gt": 0}},
+            {**_EXPORT_PRODUCT_PROJECTION, "variants.inventory_quantity": 1}
+        ).batch_size(1000).to_list(None)
+        fallback_by_id = {p.get("id"): p for p in fallback_products}
+        for inv in _fallback_inventory_levels(fallback_products, fallback_location, covered_variant_ids):
+            row = build_row(inv, fallback_by_id.get(inv["product_id"]), fallback_location, None)
+            if row:
+                yield row
+
+_CSV_FLUSH_BYTES = 64 * 1024
+
+async def _stream_csv(header: list, rows: AsyncIterator[list]) -> AsyncIterator[bytes]:
+    """Encode CSV rows as they are produced, flushing ~64KB UTF-8 chunks to the response."""
+    buf = BytesIO()
+    # csv.writer writes UTF-8 bytes straight into buf (no str buffer + encode copy)
+    text = TextIOWrapper(buf, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text)
+    writer.writerow(header)
+    async for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= _CSV_FLUSH_BYTES:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
 
-    return rows
 # ==================== EXPORT ROUTES ====================
 
+# Inventory export columns (XLSX and CSV), with fixed XLSX widths computed once
+_INVENTORY_EXPORT_HEADERS = ["Product", "Variant", "Barcode", "SKU", "Price", "Location", "Shelf", "Quantity"]
+_INVENTORY_XLSX_COLUMN_WIDTHS = {get_column_letter(i): 15 for i in range(1, len(_INVENTORY_EXPORT_HEADERS) + 1)}
+# XLSX exports stay in memory up to this size before spilling to an unlinked temp file
+_XLSX_SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+# Catalog PDF header logo, decoded once and reused on every page of every export
+def _load_catalog_logo() -> Optional[ImageReader]:
+    logo_path = (ROOT_DIR / ".." / "frontend" / "LOGOSHARKDROP.png").resolve()
+    if not logo_path.exists():
+        return None
+    try:
+        return ImageReader(str(logo_path))
+    except Exception as e:
+        logger.warning(f"Catalog logo not loaded: {e}")
+        return None
+
+_CATALOG_LOGO = _load_catalog_logo()
+
+# First number in a variant title (e.g. "EU 42.5"), used to sort catalog sizes
+_SIZE_RE = re.compile(r"(\d+(?:\.\d+)?)")
+
 @api_router.get("/export/excel")
 async def export_excel(
     location_id: Optional[str] = None,
@@ -4874,7 +5290,7 @@ async def export_excel(
             collection_product_ids = collection.get("product_ids", [])
     
     # Get inventory with product details (with Shopify fallback)
-    rows = await _build_inventory_export_rows(
+    rows = _iter_inventory_export_rows(
         location_id,
         collection_product_ids,
         search=search,
@@ -4883,52 +5299,67 @@ async def export_excel(
         variant_ids=_parse_ids(variant_ids),
     )
     
-    # Create workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Inventory"
+    # Create workbook (write-only: rows are streamed, no in-memory cell grid)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Inventory")
+    
+    # Column widths must be set before rows are appended in write-only mode
+    for letter, width in _INVENTORY_XLSX_COLUMN_WIDTHS.items():
+        ws.column_dimensions[letter].width = width
     
     # Header style
-    header_font = Font(bold=True, size=12)
     thin_border = Border(
         left=Side(style='thin'),
         right=Side(style='thin'),
         top=Side(style='thin'),
         bottom=Side(style='thin')
     )
+    header_style = NamedStyle(
+        name="inventory_header",
+        font=Font(bold=True, size=12),
+        border=thin_border,
+        alignment=Alignment(horizontal='center')
+    )
+    wb.add_named_style(header_style)
+    
+    # Headers (the only styled row)
+    header_cells = []
+    for header in _INVENTORY_EXPORT_HEADERS:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.style = header_style.name
+        header_cells.append(cell)
+    ws.append(header_cells)
+    
+    # Data rows: plain values, no per-cell styling on the hot path
+    async for inv in rows:
+        ws.append([
+            inv.get("product_title", ""),
+            inv.get("variant_title") or "",
+            inv.get("barcode") or "",
+            inv.get("sku") or "",
+            inv.get("price") or 0,
+            inv.get("location_name") or "",
+            inv.get("shelf_name") or "",
+            inv.get("quantity", 0),
+        ])
     
-    # Headers
-    headers = ["Product", "Variant", "Barcode", "SKU", "Price", "Location", "Shelf", "Quantity"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.border = thin_border
-        cell.alignment = Alignment(horizontal='center')
-    
-    # Data rows
-    row = 2
-    for inv in rows:
-        ws.cell(row=row, column=1, value=inv.get("product_title", "")).border = thin_border
-        ws.cell(row=row, column=2, value=inv.get("variant_title") or "").border = thin_border
-        ws.cell(row=row, column=3, value=inv.get("barcode") or "").border = thin_border
-        ws.cell(row=row, column=4, value=inv.get("sku") or "").border = thin_border
-        ws.cell(row=row, column=5, value=inv.get("price") or 0).border = thin_border
-        ws.cell(row=row, column=6, value=inv.get("location_name") or "").border = thin_border
-        ws.cell(row=row, column=7, value=inv.get("shelf_name") or "").border = thin_border
-        ws.cell(row=row, column=8, value=inv.get("quantity", 0)).border = thin_border
-        row += 1
-    
-    # Adjust column widths
-    for col in range(1, 9):
-        ws.column_dimensions[chr(64 + col)].width = 15
-    
-    # Save to bytes
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
+    # Save to an anonymous spooled file (memory, then an unlinked temp file past the limit):
+    # nothing is left on disk if saving fails or the client disconnects mid-transfer
+    tmp = tempfile.SpooledTemporaryFile(max_size=_XLSX_SPOOL_MAX_BYTES)
+    try:
+        await asyncio.to_thread(wb.save, tmp)
+        tmp.seek(0)
+    except Exception:
+        tmp.close()
+        raise
+
+    def iter_file():
+        with tmp:
+            while chunk := tmp.read(_CSV_FLUSH_BYTES):
+                yield chunk
+
     return StreamingResponse(
-        output,
+        iter_file(),
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers={"Content-Disposition": f"attachment; filename=inventory_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"}
     )
@@ -4953,7 +5384,7 @@ async def export_pdf(
             collection_product_ids = collection.get("product_ids", [])
     
     # Get inventory with product details (with Shopify fallback)
-    rows = await _build_inventory_export_rows(
+    rows = _iter_inventory_export_rows(
         location_id,
         collection_product_ids,
         search=search,
@@ -4964,8 +5395,10 @@ async def export_pdf(
     
     # Group by product
     products_data = {}
-    for idx, inv in enumerate(rows):
+    idx = 0
+    async for inv in rows:
         product_id = inv.get("product_id") or f"unknown-{idx}"
+        idx += 1
         if product_id not in products_data:
             products_data[product_id] = {
                 "title": inv.get("product_title", ""),
@@ -4982,22 +5415,15 @@ async def export_pdf(
             "shelf": inv.get("shelf_name", "") or ""
         })
     
-    # Create PDF
-    output = BytesIO()
-    doc = SimpleDocTemplate(output, pagesize=A4, topMargin=1.6*cm, bottomMargin=1.6*cm)
-    styles = getSampleStyleSheet()
-    elements = []
-
     export_date = datetime.now().strftime('%d/%m/%Y')
-    logo_path = (Path(__file__).resolve().parent / ".." / "frontend" / "LOGOSHARKDROP.png").resolve()
 
-    def _draw_header_footer(canvas, doc):
+    def _draw_header_footer(canvas):
         canvas.saveState()
         # Header
         header_y = A4[1] - 1.1 * cm
-        if logo_path.exists():
+        if _CATALOG_LOGO is not None:
             try:
-                canvas.drawImage(str(logo_path), 1.2 * cm, A4[1] - 1.7 * cm, width=1.2 * cm, height=1.2 * cm, mask='auto')
+                canvas.drawImage(_CATALOG_LOGO, 1.2 * cm, A4[1] - 1.7 * cm, width=1.2 * cm, height=1.2 * cm, mask='auto')
             except Exception:
                 pass
         canvas.setFont("Helvetica-Bold", 12)
@@ -5009,29 +5435,8 @@ async def export_pdf(
         canvas.drawString(1.2 * cm, 0.9 * cm, footer_text)
         canvas.restoreState()
 
-    title_style = ParagraphStyle(
-        'Title',
-        parent=styles['Title'],
-        fontSize=28,
-        spaceAfter=22
-    )
-    name_style = ParagraphStyle(
-        'Name',
-        parent=styles['Heading2'],
-        fontSize=20,
-        spaceAfter=8
-    )
-    sizes_style = ParagraphStyle(
-        'Sizes',
-        parent=styles['BodyText'],
-        fontSize=15,
-        leading=20
-    )
-
-    elements.append(Spacer(1, 12))
-
     def size_key(title: str) -> float:
-        m = re.search(r"(\\d+(?:\\.\\d+)?)", (title or "").replace(",", "."))
+        m = _SIZE_RE.search((title or "").replace(",", "."))
         if not m:
             return 9999.0
         try:
@@ -5039,8 +5444,34 @@ async def export_pdf(
         except:
             return 9999.0
 
+    # Remote product images: fetched concurrently up front through one HTTP session (connection pool)
+    remote_images: Dict[str, Optional[bytes]] = {}
+    remote_urls = list({
+        d["image_base64"] for d in products_data.values()
+        if isinstance(d.get("image_base64"), str) and d["image_base64"].startswith("http")
+    })
+    if remote_urls:
+        sem = asyncio.Semaphore(8)
+
+        async def fetch_image(session: aiohttp.ClientSession, url: str) -> Optional[bytes]:
+            async with sem:
+                try:
+                    async with session.get(url) as resp:
+                        return await resp.read() if resp.status == 200 else None
+                except Exception:
+                    return None
+
+        async with aiohttp.ClientSession() as http_session:
+            results = await asyncio.gather(*(fetch_image(http_session, u) for u in remote_urls))
+        remote_images = dict(zip(remote_urls, results))
+
+    # Decoded images keyed by content hash: identical images share one reader / PDF XObject
+    image_cache: Dict[bytes, ImageReader] = {}
+
+    # One card per product: (image reader or None, title, sizes line)
+    cards = []
     for _, data in products_data.items():
-        image_flowable = None
+        reader = None
         img_src = data.get("image_base64")
         if img_src:
             try:
@@ -5048,14 +5479,16 @@ async def export_pdf(
                 if isinstance(img_src, str) and img_src.startswith("data:image"):
                     img_bytes = base64.b64decode(img_src.split(",", 1)[1])
                 elif isinstance(img_src, str) and img_src.startswith("http"):
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(img_src) as resp:
-                            if resp.status == 200:
-                                img_bytes = await resp.read()
+                    img_bytes = remote_images.get(img_src)
                 if img_bytes:
-                    image_flowable = RLImage(BytesIO(img_bytes), width=3*cm, height=3*cm)
+                    digest = hashlib.sha1(img_bytes).digest()
+                    reader = image_cache.get(digest)
+                    if reader is None:
+                        reader = ImageReader(BytesIO(img_bytes))
+                        reader.getSize()  # fail here (no image) rather than while drawing
+                        image_cache[digest] = reader
             except Exception:
-                image_flowable = None
+                reader = None
 
         variants = sorted(data["variants"], key=lambda v: size_key(v.get("title", "")))
         size_bits = []
@@ -5063,37 +5496,59 @@ async def export_pdf(
             price = v.get("price", 0) or 0
             size_bits.append(f"{v.get('title','')}  EUR {price:.2f}")
         sizes_line = " | ".join(size_bits) if size_bits else ""
-
-        text_block = Paragraph(
-            f"<b>{data['title']}</b><br/>{sizes_line}",
-            sizes_style
-        )
-
-        if image_flowable:
-            row = [[image_flowable, text_block]]
-            table = Table(row, colWidths=[3.2*cm, 13.3*cm])
-        else:
-            row = [[text_block]]
-            table = Table(row, colWidths=[16.5*cm])
-
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), colors.white),
-            ('BOX', (0, 0), (-1, -1), 1, colors.lightgrey),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 8),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 8),
-            ('TOPPADDING', (0, 0), (-1, -1), 8),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ]))
-
-        elements.append(table)
-        elements.append(Spacer(1, 0.2*inch))
-
-    doc.build(elements, onFirstPage=_draw_header_footer, onLaterPages=_draw_header_footer)
-    output.seek(0)
+        cards.append((reader, str(data["title"] or ""), sizes_line))
+
+    def render() -> bytes:
+        """Draw the cards straight onto the canvas, top to bottom, paging as needed."""
+        output = BytesIO()
+        c = Canvas(output, pagesize=A4)
+        font_size, leading, pad = 15, 20, 8
+        card_w, img_col_w, img_size = 16.5 * cm, 3.2 * cm, 3 * cm
+        card_x = (A4[0] - card_w) / 2
+        top, bottom = A4[1] - 1.6 * cm, 1.6 * cm
+        gap = 0.2 * inch
+
+        _draw_header_footer(c)
+        y = top - 12
+        for reader, title, sizes_line in cards:
+            text_x = card_x + pad + (img_col_w if reader else 0)
+            text_w = card_w - 2 * pad - (img_col_w if reader else 0)
+            title_lines = simpleSplit(title, "Helvetica-Bold", font_size, text_w)
+            size_lines = simpleSplit(sizes_line, "Helvetica", font_size, text_w)
+            text_h = (len(title_lines) + len(size_lines)) * leading
+            card_h = max(text_h, img_size if reader else 0) + 2 * pad
+
+            if y - card_h < bottom and y < top:
+                c.showPage()
+                _draw_header_footer(c)
+                y = top
+
+            c.setStrokeColorRGB(0.83, 0.83, 0.83)  # lightgrey box
+            c.setLineWidth(1)
+            c.rect(card_x, y - card_h, card_w, card_h, stroke=1, fill=0)
+            if reader:
+                c.drawImage(reader, card_x + pad, y - pad - img_size, img_size, img_size, mask='auto')
+
+            line_y = y - pad - font_size
+            c.setFont("Helvetica-Bold", font_size)
+            for line in title_lines:
+                c.drawString(text_x, line_y, line)
+                line_y -= leading
+            c.setFont("Helvetica", font_size)
+            for line in size_lines:
+                c.drawString(text_x, line_y, line)
+                line_y -= leading
+
+            y -= card_h + gap
+
+        c.save()
+        return output.getvalue()
+
+    # Drawing and image encoding are CPU-bound: keep them off the event loop
+    pdf_bytes = await asyncio.to_thread(render)
     
     return StreamingResponse(
-        output,
+        BytesIO(pdf_bytes),
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename=catalog_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"}
     )
@@ -5116,7 +5571,7 @@ async def export_csv(
         if collection:
             collection_product_ids = collection.get("product_ids", [])
 
-    rows = await _build_inventory_export_rows(
+    rows = _iter_inventory_export_rows(
         location_id,
         collection_product_ids,
         search=search,
@@ -5125,12 +5580,8 @@ async def export_csv(
         variant_ids=_parse_ids(variant_ids),
     )
 
-    from io import StringIO
-    string_io = StringIO()
-    writer = csv.writer(string_io)
-    writer.writerow(["Product", "Variant", "Barcode", "SKU", "Price", "Location", "Shelf", "Quantity"])
-    for inv in rows:
-        writer.writerow([
+    csv_rows = (
+        [
             inv.get("product_title", ""),
             inv.get("variant_title") or "",
             inv.get("barcode") or "",
@@ -5139,57 +5590,76 @@ async def export_csv(
             inv.get("location_name") or "",
             inv.get("shelf_name") or "",
             inv.get("quantity", 0)
-        ])
-    output = BytesIO(string_io.getvalue().encode("utf-8"))
-    output.seek(0)
+        ]
+        async for inv in rows
+    )
 
     return StreamingResponse(
-        output,
+        _stream_csv(_INVENTORY_EXPORT_HEADERS, csv_rows),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename=inventory_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"}
     )
 
 # ==================== DASHBOARD ====================
 
+# Dashboard/analytics responses are polled by the UI: serve repeats from memory for a short TTL.
+# Inventory movements and Shopify syncs invalidate it; other writes show up within the TTL.
+_DASHBOARD_CACHE_TTL = 15.0
+_dashboard_cache: Dict[str, tuple] = {}
+
+def _dashboard_cache_get(key: str) -> Optional[dict]:
+    entry = _dashboard_cache.get(key)
+    if entry and time.monotonic() - entry[0] < _DASHBOARD_CACHE_TTL:
+        return entry[1]
+    return None
+
+def _dashboard_cache_set(key: str, value: dict) -> dict:
+    _dashboard_cache[key] = (time.monotonic(), value)
+    return value
+
+def _invalidate_dashboard_cache():
+    _dashboard_cache.clear()
+
 @api_router.get("/dashboard/stats")
 async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
     """Get dashboard statistics"""
-    # Total products
-    total_products = await db.products.count_documents({"is_active": True})
-    
+    cached = _dashboard_cache_get("stats")
+    if cached is not None:
+        return cached
+
+    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
     # Total inventory items
     pipeline = [
         {"$match": {"quantity": {"$gt": 0}}},
         {"$group": {"_id": None, "total": {"$sum": "$quantity"}}}
     ]
-    inv_result = await db.inventory_levels.aggregate(pipeline).to_list(1)
-    total_inventory = inv_result[0]["total"] if inv_result else 0
-    
-    # Locations count
-    total_locations = await db.locations.count_documents({"is_active": True})
-    
-    # Today's transactions
-    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    today_transactions = await db.inventory_transactions.count_documents({
-        "created_at": {"$gte": today_start}
-    })
-    
-    # Recent transactions
-    recent_tx = await db.inventory_transactions.find({}, {"_id": 0}).sort("created_at", -1).limit(5).to_list(5)
-
     # Inventory source breakdown
-    source_breakdown = {}
     source_pipeline = [
         {"$group": {"_id": "$source", "total": {"$sum": "$quantity"}}}
     ]
-    source_result = await db.inventory_levels.aggregate(source_pipeline).to_list(10)
-    for row in source_result:
-        source_breakdown[row.get("_id") or "unknown"] = row.get("total", 0)
 
-    # Shopify sync status (for dashboard hints)
-    sync_state = await db.shopify_sync_state.find_one({}, {"_id": 0})
+    # Independent queries: run them concurrently
+    (
+        total_products,
+        inv_result,
+        total_locations,
+        today_transactions,
+        recent_tx,
+        source_result,
+        sync_state,
+    ) = await asyncio.gather(
+        db.products.count_documents({"is_active": True}),
+        db.inventory_levels.aggregate(pipeline).to_list(1),
+        db.locations.count_documents({"is_active": True}),
+        db.inventory_transactions.count_documents({"created_at": {"$gte": today_start}}),
+        db.inventory_transactions.find({}, {"_id": 0}).sort("created_at", -1).limit(5).to_list(5),
+        db.inventory_levels.aggregate(source_pipeline).to_list(10),
+        db.shopify_sync_state.find_one({}, {"_id": 0}),
+    )
+    total_inventory = inv_result[0]["total"] if inv_result else 0
+    source_breakdown = {row.get("_id") or "unknown": row.get("total", 0) for row in source_result}
     
-    return {
+    return _dashboard_cache_set("stats", {
         "total_products": total_products,
         "total_inventory": total_inventory,
         "total_locations": total_locations,
@@ -5198,7 +5668,7 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
         "inventory_sources": source_breakdown,
         "shopify_sync_status": sync_state.get("status") if sync_state else "never_synced",
         "shopify_last_sync_at": sync_state.get("last_sync_at") if sync_state else None
-    }
+    })
 
 # ==================== ANALYTICS & SALES ====================
 
@@ -5223,46 +5693,74 @@ def _parse_date_range(date: Optional[str] = None, month: Optional[str] = None, f
 @api_router.get("/analytics/summary")
 async def get_analytics_summary(current_user: dict = Depends(get_current_user)):
     """Analytics summary for dashboard (today + weekly)"""
+    cached = _dashboard_cache_get("analytics_summary")
+    if cached is not None:
+        return cached
+
     now = datetime.utcnow()
     today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     tomorrow = today_start + timedelta(days=1)
     week_start = today_start - timedelta(days=6)
 
-    # Today stats
-    tx_today = await db.inventory_transactions.find(
-        {"created_at": {"$gte": today_start, "$lt": tomorrow}},
-        {"_id": 0}
-    ).to_list(10000)
-    received_today = sum(t.get("quantity", 0) for t in tx_today if t.get("transaction_type") == "receive")
-    sold_today = sum(t.get("quantity", 0) for t in tx_today if t.get("transaction_type") == "sale")
-    revenue_today = sum((t.get("sale_price") or 0) * (t.get("quantity") or 0) for t in tx_today if t.get("transaction_type") == "sale")
+    # Per-day quantity/revenue totals for the week, grouped server-side (today is the last bucket)
+    grouped = await db.inventory_transactions.aggregate([
+        {"$match": {
+            "created_at": {"$gte": week_start, "$lt": tomorrow},
+            "transaction_type": {"$in": ["sale", "receive"]},
+        }},
+        {"$group": {
+            "_id": {
+                "d": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+                "t": "$transaction_type",
+            },
+            "qty": {"$sum": {"$ifNull": ["$quantity", 0]}},
+            "rev": {"$sum": {"$multiply": [{"$ifNull": ["$sale_price", 0]}, {"$ifNull": ["$quantity", 0]}]}},
+        }},
+    ]).to_list(None)
+    totals = {(g["_id"]["d"], g["_id"]["t"]): g for g in grouped}
+    empty = {"qty": 0, "rev": 0}
 
-    # Weekly series (last 7 days)
-    tx_week = await db.inventory_transactions.find(
-        {"created_at": {"$gte": week_start, "$lt": tomorrow}},
-        {"_id": 0}
-    ).to_list(10000)
     series = []
     for i in range(7):
-        day = week_start + timedelta(days=i)
-        day_end = day + timedelta(days=1)
-        day_tx = [t for t in tx_week if day <= t.get("created_at") < day_end]
-        day_sales_qty = sum(t.get("quantity", 0) for t in day_tx if t.get("transaction_type") == "sale")
-        day_sales_amount = sum((t.get("sale_price") or 0) * (t.get("quantity") or 0) for t in day_tx if t.get("transaction_type") == "sale")
-        day_received = sum(t.get("quantity", 0) for t in day_tx if t.get("transaction_type") == "receive")
+        day_key = (week_start + timedelta(days=i)).strftime("%Y-%m-%d")
+        sales = totals.get((day_key, "sale"), empty)
         series.append({
-            "date": day.strftime("%Y-%m-%d"),
-            "sales_qty": day_sales_qty,
-            "sales_amount": day_sales_amount,
-            "received_qty": day_received
+            "date": day_key,
+            "sales_qty": sales["qty"],
+            "sales_amount": sales["rev"],
+            "received_qty": totals.get((day_key, "receive"), empty)["qty"]
         })
 
-    return {
+    today = series[-1]
+    received_today = today["received_qty"]
+    sold_today = today["sales_qty"]
+    revenue_today = today["sales_amount"]
+
+    return _dashboard_cache_set("analytics_summary", {
         "received_today": received_today,
         "sold_today": sold_today,
         "revenue_today": revenue_today,
         "weekly": series
-    }
+    })
+
+_NO_VARIANT_TITLES = (None, None)
+
+# Sale transaction fields read by the sales CSV export, in row order
+_SALES_EXPORT_FIELDS = ("variant_id", "product_title", "variant_title", "created_at", "quantity", "sale_price")
+
+async def _sales_variant_titles(variant_ids: List[str]) -> Dict[str, tuple]:
+    """Map variant id -> (product title, variant title), flattened server-side (uses the variants.id index)."""
+    if not variant_ids:
+        return {}
+    ids = list(set(variant_ids))
+    docs = await db.products.aggregate([
+        {"$match": {"variants.id": {"$in": ids}}},
+        {"$project": {"_id": 0, "title": 1, "variants.id": 1, "variants.title": 1}},
+        {"$unwind": "$variants"},
+        {"$match": {"variants.id": {"$in": ids}}},
+        {"$project": {"vid": "$variants.id", "pt": "$title", "vt": "$variants.title"}},
+    ]).to_list(None)
+    return {d["vid"]: (d.get("pt"), d.get("vt")) for d in docs}
 
 @api_router.get("/sales")
 async def list_sales(
@@ -5283,27 +5781,22 @@ async def list_sales(
     txs = await db.inventory_transactions.find(query, {"_id": 0}).sort("created_at", -1).skip(offset).limit(limit).to_list(limit)
 
     variant_ids = [t.get("variant_id") for t in txs if t.get("variant_id")]
-    products = await db.products.find({"variants.id": {"$in": variant_ids}}, {"_id": 0}).to_list(10000)
-    variant_map = {}
-    for p in products:
-        for v in p.get("variants", []):
-            variant_map[v.get("id")] = {
-                "product_title": p.get("title"),
-                "variant_title": v.get("title")
-            }
+    variant_map = await _sales_variant_titles(variant_ids)
 
-    items = []
-    for t in txs:
-        vinfo = variant_map.get(t.get("variant_id"), {})
-        items.append({
+    vm_get = variant_map.get
+    titles = [vm_get(t.get("variant_id"), _NO_VARIANT_TITLES) for t in txs]
+    items = [
+        {
             "id": t.get("id"),
             "created_at": t.get("created_at"),
             "quantity": t.get("quantity", 0),
             "sale_price": t.get("sale_price", 0),
             "total_amount": (t.get("sale_price") or 0) * (t.get("quantity") or 0),
-            "product_title": vinfo.get("product_title") or t.get("product_title"),
-            "variant_title": vinfo.get("variant_title") or t.get("variant_title"),
-        })
+            "product_title": product_title or t.get("product_title"),
+            "variant_title": variant_title or t.get("variant_title"),
+        }
+        for t, (product_title, variant_title) in zip(txs, titles)
+    ]
     return {"total": total, "sales": items}
 
 @api_router.get("/sales/export/csv")
@@ -5320,36 +5813,30 @@ async def export_sales_csv(
     query: Dict[str, Any] = {"transaction_type": "sale"}
     if start and end:
         query["created_at"] = {"$gte": start, "$lt": end}
-    txs = await db.inventory_transactions.find(query, {"_id": 0}).sort("created_at", -1).to_list(10000)
-
-    variant_ids = [t.get("variant_id") for t in txs if t.get("variant_id")]
-    products = await db.products.find({"variants.id": {"$in": variant_ids}}, {"_id": 0}).to_list(10000)
-    variant_map = {}
-    for p in products:
-        for v in p.get("variants", []):
-            variant_map[v.get("id")] = {
-                "product_title": p.get("title"),
-                "variant_title": v.get("title")
-            }
+    # Variant titles are resolved up front so the transactions can be streamed straight from the cursor
+    variant_ids = [v for v in await db.inventory_transactions.distinct("variant_id", query) if v]
+    variant_map = await _sales_variant_titles(variant_ids)
+
+    async def sales_rows():
+        projection = {"_id": 0, **{f: 1 for f in _SALES_EXPORT_FIELDS}}
+        txs = db.inventory_transactions.find(query, projection).sort("created_at", -1).limit(10000)
+        vm_get = variant_map.get
+        fields = _SALES_EXPORT_FIELDS
+        no_titles = _NO_VARIANT_TITLES
+        async for t in txs:
+            variant_id, product_title, variant_title, created_at, quantity, sale_price = map(t.get, fields)
+            v_product_title, v_variant_title = vm_get(variant_id, no_titles)
+            yield [
+                v_product_title or product_title or "",
+                v_variant_title or variant_title or "",
+                created_at.isoformat(sep=" ", timespec="minutes") if created_at else "",
+                0 if quantity is None else quantity,
+                0 if sale_price is None else sale_price,
+                (sale_price or 0) * (quantity or 0)
+            ]
 
-    from io import StringIO
-    string_io = StringIO()
-    writer = csv.writer(string_io)
-    writer.writerow(["Product", "Variant", "Sale Date", "Quantity", "Sale Price", "Total Amount"])
-    for t in txs:
-        vinfo = variant_map.get(t.get("variant_id"), {})
-        writer.writerow([
-            vinfo.get("product_title") or t.get("product_title") or "",
-            vinfo.get("variant_title") or t.get("variant_title") or "",
-            t.get("created_at").strftime("%Y-%m-%d %H:%M") if t.get("created_at") else "",
-            t.get("quantity", 0),
-            t.get("sale_price", 0),
-            (t.get("sale_price") or 0) * (t.get("quantity") or 0)
-        ])
-    output = BytesIO(string_io.getvalue().encode("utf-8"))
-    output.seek(0)
     return StreamingResponse(
-        output,
+        _stream_csv(["Product", "Variant", "Sale Date", "Quantity", "Sale Price", "Total Amount"], sales_rows()),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename=sales_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"}
     )
@@ -5384,6 +5871,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+async def _ensure_unique_variant_ids():
+    """Prepare products for the unique variants.id index, or refuse to start.
+
+    Variants without an id would all index as null and collide, so they get one.
+    Ids shared across products cannot be fixed automatically (inventory refers to them).
+    """
+    async for product in db.products.find({"variants": {"$elemMatch": {"id": None}}}, {"_id": 1, "variants": 1}):
+        variants = [v if v.get("id") else {**v, "id": str(uuid.uuid4())} for v in product.get("variants", [])]
+        await db.products.update_one({"_id": product["_id"]}, {"$set": {"variants": variants}})
+
+    duplicates = await db.products.aggregate([
+        {"$unwind": "$variants"},
+        {"$group": {"_id": "$variants.id", "products": {"$addToSet": "$_id"}}},
+        {"$match": {"products.1": {"$exists": True}}},
+        {"$limit": 20},
+    ]).to_list(None)
+    if duplicates:
+        context = {"duplicates": [{"variant_id": d["_id"], "product_ids": [str(p) for p in d["products"]]} for d in duplicates]}
+        await log_system_event("critical", "Duplicate products.variants.id values: unique index not created", context)
+        raise RuntimeError(
+            f"Duplicate variant ids across products, fix them before starting: {context['duplicates']}"
+        )
+
 @app.on_event("startup")
 async def startup_db_client():
     # Create indexes
@@ -5394,13 +5904,24 @@ async def startup_db_client():
     await db.products.create_index("is_active")
     await db.products.create_index("variants.barcode")
     await db.products.create_index("variants.upc_backup")
+    await _ensure_unique_variant_ids()
+    await db.products.create_index(
+        "variants.id",
+        unique=True,
+        partialFilterExpression={"variants.id": {"$exists": True}}
+    )
+    await db.products.create_index([("variants.barcode", 1), ("shopify_product_id", 1)])
     await db.shelves.create_index("barcode", unique=True)
+    await db.shelves.create_index("id")
+    await db.locations.create_index("id")
     await db.inventory_levels.create_index([("variant_id", 1), ("location_id", 1), ("shelf_id", 1)])
+    await db.inventory_levels.create_index("source")
     await db.action_logs.create_index("created_at")
     await db.action_logs.create_index("user_id")
     await db.action_logs.create_index("action_type")
     await db.inventory_transactions.create_index("user_id")
     await db.inventory_transactions.create_index("created_at")
+    await db.inventory_transactions.create_index([("transaction_type", 1), ("created_at", -1)])
     await db.system_logs.create_index("created_at")
     await db.stall_items.create_index("status")
     await db.stall_items.create_index("created_at")
@@ -5408,8 +5929,32 @@ async def startup_db_client():
     await db.stockx_lookups.create_index("barcode")
     await db.stockx_import_jobs.create_index("created_at")
     await db.stockx_import_jobs.create_index("status")
+    try:
+        await db.purchase_links.create_index(
+            "token",
+            unique=True,
+            partialFilterExpression={"token": {"$exists": True}}
+        )
+    except Exception as e:
+        # Legacy duplicates must not prevent startup
+        logger.warning(f"Unique index on purchase_links.token not created: {e}")
+        await db.purchase_links.create_index("token")
+    await db.purchase_links.create_index(
+        [("status", 1), ("expires_at", 1)],
+        partialFilterExpression={"status": "pending"}
+    )
     await db.purchase_identities.create_index("identity_key", unique=True)
     await db.purchase_identities.create_index("last_used_at")
+
+    # Legacy purchase links stored expires_at as ISO strings: convert them to BSON dates once.
+    # Unparseable values are left untouched (never nulled) and reported.
+    await db.purchase_links.update_many(
+        {"expires_at": {"$type": "string"}},
+        [{"$set": {"expires_at": {"$dateFromString": {"dateString": "$expires_at", "onError": "$expires_at"}}}}]
+    )
+    bad_expiry = await db.purchase_links.count_documents({"expires_at": {"$type": "string"}})
+    if bad_expiry:
+        logger.warning(f"{bad_expiry} purchase links have an unparseable string expires_at")
     
     # Create or update default admin
     admin = await db.users.find_one({"username": "admin"})
@@ -8,17 +8,23 @@ from pathlib import Path
 import argparse
 
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 
 
 ROOT = Path(__file__).resolve().parents[1]
 load_dotenv(ROOT / "backend" / ".env")
 
+BATCH_SIZE = 1000
+
+_WS_RE = re.compile(r"\s+")
+_PROV_RE = re.compile(r"[A-Z]{2,3}")
+_NONDIGIT_RE = re.compile(r"\D+")
+
 
 def _normalize_identity_str(value):
     if value is None:
         return ""
-    return re.sub(r"\s+", " ", str(value).strip().upper())
+    return _WS_RE.sub(" ", str(value).strip().upper())
 
 
 def _build_identity_key(data: dict) -> str:
@@ -44,12 +50,21 @@ def _build_identity_key(data: dict) -> str:
     return f"HASH:{digest}"
 
 
+_MOJIBAKE_MARKERS = ("Ã", "â", "Â")
+
+# CSV columns, in the order main() unpacks them
+CSV_COLUMNS = (
+    "Nome", "Cognome", "Data_Nascita", "Luogo_Nascita", "Prov_Nascita", "Indirizzo",
+    "Provincia", "CAP", "Telefono", "Email", "Codice_Fiscale",
+)
+
+
 def _repair_mojibake(value: str) -> str:
     if value is None:
         return ""
     s = str(value)
     # Attempt to fix common UTF-8 read as latin-1 artifacts.
-    if "Ã" in s or "â" in s or "Â" in s:
+    if any(m in s for m in _MOJIBAKE_MARKERS):
         try:
             return s.encode("latin1").decode("utf-8")
         except Exception:
@@ -57,10 +72,10 @@ def _repair_mojibake(value: str) -> str:
     return s
 
 
-def _parse_address_city(raw: str):
+def _parse_address_city(raw: str, repair: bool = True):
     if not raw:
         return "", ""
-    text = _repair_mojibake(raw).strip()
+    text = (_repair_mojibake(raw) if repair else raw).strip()
     if "," in text:
         addr, city = text.rsplit(",", 1)
         return addr.strip(), city.strip()
@@ -69,9 +84,9 @@ def _parse_address_city(raw: str):
 
 def _guess_residence_country(res_prov: str, cap: str):
     prov = (res_prov or "").strip().upper()
-    if prov and re.fullmatch(r"[A-Z]{2,3}", prov):
+    if prov and _PROV_RE.fullmatch(prov):
         return "IT"
-    cap_digits = re.sub(r"\D+", "", cap or "")
+    cap_digits = _NONDIGIT_RE.sub("", cap or "")
     if cap_digits:
         return "IT"
     return ""
@@ -116,22 +131,32 @@ def main():
     inserted = 0
     updated = 0
     now = datetime.utcnow()
+    # Pending upserts keyed by identity_key: a repeated identity in the same batch keeps its last row
+    pending = {}
+
+    def flush():
+        nonlocal inserted, updated
+        if not pending:
+            return
+        res = col.bulk_write(list(pending.values()), ordered=False)
+        inserted += res.upserted_count
+        updated += res.modified_count
+        pending.clear()
 
     with csv_path.open("r", encoding="utf-8-sig", newline="") as f:
+        # Repair is only needed if the file contains mojibake at all: check once, not per field
+        fix = any(m in line for line in f for m in _MOJIBAKE_MARKERS)
+        f.seek(0)
         reader = csv.DictReader(f)
         for row in reader:
-            nome = _repair_mojibake(row.get("Nome", "")).strip()
-            cognome = _repair_mojibake(row.get("Cognome", "")).strip()
-            birth_date = _repair_mojibake(row.get("Data_Nascita", "")).strip()
-            birth_place = _repair_mojibake(row.get("Luogo_Nascita", "")).strip()
-            birth_country = _repair_mojibake(row.get("Prov_Nascita", "")).strip()
-            indirizzo_raw = row.get("Indirizzo", "") or ""
-            residence_address, residence_city = _parse_address_city(indirizzo_raw)
-            residence_province = _repair_mojibake(row.get("Provincia", "")).strip()
-            residence_cap = _repair_mojibake(row.get("CAP", "")).strip()
-            phone = _repair_mojibake(row.get("Telefono", "")).strip()
-            email = _repair_mojibake(row.get("Email", "")).strip()
-            fiscal = _repair_mojibake(row.get("Codice_Fiscale", "")).strip()
+            values = (row.get(c) or "" for c in CSV_COLUMNS)
+            if fix:
+                values = (_repair_mojibake(v) for v in values)
+            (
+                nome, cognome, birth_date, birth_place, birth_country, indirizzo,
+                residence_province, residence_cap, phone, email, fiscal,
+            ) = (v.strip() for v in values)
+            residence_address, residence_city = _parse_address_city(indirizzo, repair=False)
 
             data = {
                 "first_name": nome,
@@ -150,7 +175,7 @@ def main():
             }
 
             identity_key = _build_identity_key(data)
-            res = col.update_one(
+            pending[identity_key] = UpdateOne(
                 {"identity_key": identity_key},
                 {
                     "$set": {
@@ -166,10 +191,10 @@ def main():
                 },
                 upsert=True,
             )
-            if res.upserted_id:
-                inserted += 1
-            elif res.modified_count:
-                updated += 1
+            if len(pending) >= BATCH_SIZE:
+                flush()
+
+    flush()
 
     print(f"IDENTITIES importate. Nuove: {inserted} | Aggiornate: {updated}")
 
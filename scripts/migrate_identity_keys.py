@@ -4,13 +4,17 @@ import re
 import hashlib
 from datetime import datetime
 
-from pymongo import MongoClient
+from pymongo import DeleteOne, MongoClient, UpdateOne
+
+
+_WS_RE = re.compile(r"\s+")
+BATCH_SIZE = 1000
 
 
 def _norm(v):
     if v is None:
         return ""
-    return re.sub(r"\s+", " ", str(v).strip().upper())
+    return _WS_RE.sub(" ", str(v).strip().upper())
 
 
 def _key(data: dict) -> str:
@@ -49,24 +53,44 @@ def main():
     seen = {}
     removed = 0
     updated = 0
-    docs = list(col.find({}, {"_id": 1, "data": 1}))
-    for doc in docs:
-        data = doc.get("data") or {}
-        key = _key(data)
-        if key in seen:
-            base = seen[key]
-            merged = dict(base.get("data") or {})
-            for k, v in (data or {}).items():
-                if (not merged.get(k)) and v:
-                    merged[k] = v
-            col.update_one({"_id": base["_id"]}, {"$set": {"identity_key": key, "data": merged, "updated_at": now}})
-            col.delete_one({"_id": doc["_id"]})
-            removed += 1
-            updated += 1
-        else:
-            col.update_one({"_id": doc["_id"]}, {"$set": {"identity_key": key}})
-            seen[key] = doc
-            updated += 1
+    # Pending writes keyed by _id: a base merged several times in one batch is written once, with its latest data
+    updates = {}
+    deletes = []
+
+    def flush():
+        ops = list(updates.values()) + deletes
+        if ops:
+            col.bulk_write(ops, ordered=False)
+        updates.clear()
+        deletes.clear()
+
+    cursor = col.find({}, {"_id": 1, "data": 1}, no_cursor_timeout=True).batch_size(BATCH_SIZE)
+    try:
+        for doc in cursor:
+            data = doc.get("data") or {}
+            key = _key(data)
+            if key in seen:
+                base = seen[key]
+                merged = dict(base["data"])
+                for k, v in data.items():
+                    if (not merged.get(k)) and v:
+                        merged[k] = v
+                base["data"] = merged
+                updates[base["_id"]] = UpdateOne(
+                    {"_id": base["_id"]}, {"$set": {"identity_key": key, "data": merged, "updated_at": now}}
+                )
+                deletes.append(DeleteOne({"_id": doc["_id"]}))
+                removed += 1
+                updated += 1
+            else:
+                updates[doc["_id"]] = UpdateOne({"_id": doc["_id"]}, {"$set": {"identity_key": key}})
+                seen[key] = {"_id": doc["_id"], "data": data}
+                updated += 1
+            if len(updates) + len(deletes) >= BATCH_SIZE:
+                flush()
+    finally:
+        cursor.close()
+    flush()
 
     col.create_index("identity_key", unique=True)
     print(f"IDENTITIES migrate complete. Updated: {updated} | Removed dup: {removed}")
@@ -0,0 +1,298 @@
+"""Equivalence tests for the inventory export and purchase PDF helpers.
+
+Each test compares the current implementation with the original (pre-optimization)
+behaviour, reproduced here as a reference.
+"""
+import asyncio
+import csv
+import os
+import sys
+from io import StringIO
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("motor")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+
+import server  # noqa: E402
+
+
+async def _collect(agen):
+    return [item async for item in agen]
+
+
+# ==================== INVENTORY EXPORT ROWS ====================
+
+async def _reference_export_rows(db, location_id, collection_product_ids, search=None, size=None, product_ids=None, variant_ids=None):
+    """Original _build_inventory_export_rows: one find_one per row, filters applied in Python."""
+    query = {"location_id": location_id} if location_id else {}
+    inventory = []
+    for inv in await db.inventory_levels.find(query, {"_id": 0}).to_list(None):
+        try:
+            qty = int(inv.get("quantity", 0))
+        except (TypeError, ValueError):
+            qty = 0
+        if qty > 0:
+            inv["quantity"] = qty
+            inventory.append(inv)
+    covered = {inv.get("variant_id") for inv in inventory if inv.get("variant_id")}
+    fallback_location = await server._get_fallback_location(location_id)
+    if fallback_location:
+        products = await db.products.find({"is_active": True}, {"_id": 0}).to_list(None)
+        inventory.extend(server._fallback_inventory_levels(products, fallback_location, covered))
+
+    search_l = search.lower().strip() if search else None
+    size_l = size.lower().strip() if size else None
+    rows = []
+    for inv in inventory:
+        qty = int(inv.get("quantity", 0))
+        if qty <= 0:
+            continue
+        product = await db.products.find_one({"variants.id": inv.get("variant_id")})
+        if not product and inv.get("product_id"):
+            product = await db.products.find_one({"id": inv.get("product_id")})
+        if collection_product_ids is not None:
+            if not product or product.get("id") not in collection_product_ids:
+                continue
+        variant = None
+        if product:
+            variant = next((v for v in product.get("variants", []) if v.get("id") == inv.get("variant_id")), None)
+        location = await db.locations.find_one({"id": inv.get("location_id")})
+        shelf = await db.shelves.find_one({"id": inv.get("shelf_id")}) if inv.get("shelf_id") else None
+
+        product_title = product.get("title") if product else inv.get("product_title") or f"Unknown ({inv.get('variant_id')})"
+        variant_title = (variant.get("title") if variant else None) or inv.get("variant_title")
+        barcode = (variant.get("barcode") if variant else None) or inv.get("variant_barcode")
+        upc_backup = (variant.get("upc_backup") if variant else None) or inv.get("variant_upc_backup")
+        sku = (variant.get("sku") if variant else None) or inv.get("variant_sku")
+        price = (variant.get("price") if variant else None) or inv.get("variant_price") or 0
+        product_image = (product.get("image_base64") or product.get("image_url")) if product else inv.get("product_image")
+        product_id = (product.get("id") if product else None) or inv.get("product_id") or inv.get("variant_id")
+
+        if variant_ids is not None and inv.get("variant_id") not in variant_ids:
+            continue
+        if product_ids is not None and variant_ids is None and product_id not in product_ids:
+            continue
+        if size_l and size_l not in (variant_title or "").lower():
+            continue
+        if search_l:
+            hay = f"{product_title} {variant_title or ''} {barcode or ''} {upc_backup or ''} {sku or ''}".lower()
+            if search_l not in hay:
+                continue
+
+        rows.append({
+            "product_id": product_id,
+            "product_title": product_title,
+            "variant_title": variant_title,
+            "barcode": barcode,
+            "upc_backup": upc_backup,
+            "sku": sku,
+            "price": price,
+            "location_name": location.get("name") if location else "",
+            "shelf_name": shelf.get("name") if shelf else "",
+            "quantity": qty,
+            "product_image": product_image,
+        })
+    return rows
+
+
+async def _seed(db):
+    await db.locations.insert_many([
+        {"id": "loc-wh", "name": "Magazzino", "is_active": True},
+        {"id": "loc-shop", "name": "Negozio", "is_active": True},
+    ])
+    await db.shelves.insert_many([{"id": "sh-1", "name": "A1"}])
+    await db.products.insert_many([
+        {
+            "id": "p-1", "title": "Nike Dunk Low", "is_active": True, "tags": ["sneakers"],
+            "image_url": "https://cdn/p1.jpg",
+            "variants": [
+                {"id": "v-1a", "title": "42", "barcode": "111", "sku": "DD1391-42", "price": 120.0, "inventory_quantity": 3},
+                {"id": "v-1b", "title": "42.5", "barcode": "112", "sku": 4250.0, "price": 0, "inventory_quantity": 2},
+                {"id": "v-1c", "title": "EU 44", "barcode": None, "upc_backup": "999", "inventory_quantity": 0},
+            ],
+        },
+        {
+            "id": "p-2", "title": "Jordan 4", "is_active": True, "tags": ["NOGESTIONALE"],
+            "image_base64": "data:image/png;base64,AAAA",
+            "variants": [
+                {"id": "v-2a", "title": "43", "sku": "J4-43", "price": 250, "inventory_quantity": "4"},
+                {"id": "v-2b", "title": "44", "sku": "J4-44", "inventory_quantity": None},
+            ],
+        },
+        {
+            "id": "p-3", "title": "Archived", "is_active": False,
+            "variants": [{"id": "v-3a", "title": "40", "inventory_quantity": 7}],
+        },
+    ])
+    await db.inventory_levels.insert_many([
+        {"id": "i-1", "variant_id": "v-1a", "product_id": "p-1", "location_id": "loc-wh", "shelf_id": "sh-1", "quantity": 2},
+        {"id": "i-2", "variant_id": "v-1a", "product_id": "p-1", "location_id": "loc-shop", "quantity": 0},
+        {"id": "i-3", "variant_id": "v-2a", "product_id": "p-2", "location_id": "loc-shop", "quantity": "5"},
+        {"id": "i-4", "variant_id": "v-gone", "product_id": "p-1", "location_id": "loc-wh", "quantity": 1,
+         "variant_title": "41", "variant_sku": "OLD-41"},
+        {"id": "i-5", "variant_id": "v-orphan", "location_id": "loc-wh", "quantity": 6,
+         "product_title": "Yeezy 350", "variant_title": "45", "variant_barcode": "555"},
+        {"id": "i-6", "variant_id": "v-3a", "product_id": "p-3", "location_id": "loc-shop", "quantity": "x"},
+    ])
+
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"location_id": "loc-wh"},
+    {"location_id": "loc-shop"},
+    {"size": "42"},
+    {"size": " 42.5 "},
+    {"size": "44"},
+    {"search": "dunk"},
+    {"search": "555"},
+    {"search": "4250.0"},
+    {"search": "unknown"},
+    {"search": "old-41", "size": "41"},
+    {"collection_product_ids": ["p-2"]},
+    {"product_ids": ["p-1"]},
+    {"variant_ids": ["v-1b", "v-orphan"], "product_ids": ["p-2"]},
+])
+def test_inventory_export_rows_match_reference(kwargs, monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    db = mongomock_motor.AsyncMongoMockClient()["export_test"]
+    monkeypatch.setattr(server, "db", db)
+
+    async def run():
+        await _seed(db)
+        args = dict(location_id=None, collection_product_ids=None)
+        args.update(kwargs)
+        expected = await _reference_export_rows(db, **args)
+        actual = await _collect(server._iter_inventory_export_rows(**args))
+        return expected, actual
+
+    expected, actual = asyncio.run(run())
+    assert actual == expected
+
+
+# ==================== CSV STREAMING ====================
+
+def _reference_csv(header, rows) -> bytes:
+    string_io = StringIO()
+    writer = csv.writer(string_io)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+    return string_io.getvalue().encode("utf-8")
+
+
+@pytest.mark.parametrize("row_count", [0, 1, 5000])
+def test_stream_csv_matches_reference(row_count):
+    rows = [
+        [f"Scarpa “{i}” àèìòù", f'4{i % 10}, "EU"', i * 1.5, None, "", "riga\nsu due"]
+        for i in range(row_count)
+    ]
+
+    async def agen():
+        for row in rows:
+            yield row
+
+    chunks = asyncio.run(_collect(server._stream_csv(server._INVENTORY_EXPORT_HEADERS, agen())))
+    body = b"".join(chunks)
+    assert body == _reference_csv(server._INVENTORY_EXPORT_HEADERS, rows)
+    assert not body.startswith(b"\xef\xbb\xbf")
+    body.decode("utf-8")
+    if row_count == 5000:
+        assert len(chunks) > 1
+
+
+# ==================== PURCHASE PDF ====================
+
+def _reference_font_size(text, font, size, max_w, min_size=14.0):
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+
+    if stringWidth(text, font, size) <= max_w:
+        return size
+    cur = size
+    while cur > min_size and stringWidth(text, font, cur) > max_w:
+        cur -= 0.5
+    return cur
+
+
+@pytest.mark.parametrize("text", [
+    "Mario Rossi",
+    "Via Giuseppe Garibaldi 123, Scala B, Interno 7",
+    "RSSMRA80A01H501U",
+    "W" * 80,
+    "mario.rossi.con.un.indirizzo.molto.lungo@example.com",
+])
+@pytest.mark.parametrize("size", [22.0, 24.0])
+@pytest.mark.parametrize("max_w", [33.0, 90.0, 140.0, 420.0, 597.0])
+def test_fit_font_size_matches_shrink_loop(text, size, max_w):
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+
+    width = stringWidth(text, "Helvetica", size)
+    assert server._fit_font_size(width, size, max_w) == _reference_font_size(text, "Helvetica", size, max_w)
+
+
+def _reference_signature_lines(path, x, y, scale_x, scale_y, view_h):
+    lines = []
+    last = None
+    for cmd, px, py in path:
+        dx = x + px * scale_x
+        dy = y + (view_h - py) * scale_y
+        if cmd == 'M':
+            last = (dx, dy)
+        elif cmd == 'L' and last:
+            lines.append([last[0], last[1], dx, dy])
+            last = (dx, dy)
+    return lines
+
+
+@pytest.mark.parametrize("path", [
+    [("M", 10, 20), ("L", 30, 40), ("L", 50, 25.5)],
+    [("M", 0, 0), ("L", 1, 1), ("M", 5, 5), ("L", 6, 7), ("L", 8, 9)],
+    [("L", 3, 3), ("L", 4, 4), ("M", 1, 2), ("L", 2, 3)],
+    [("M", 1, 1), ("M", 2, 2)],
+    [("M", 1, 1)],
+    [],
+])
+def test_signature_segments_match_line_loop(path):
+    args = (70.0, 120.0, 0.5, 0.4, 180.0)
+    actual = server._signature_segments(path, *args)
+    expected = _reference_signature_lines(path, *args)
+    assert len(actual) == len(expected)
+    for got, want in zip(actual, expected):
+        assert got == pytest.approx(want)
+
+
+def test_draw_signature_uses_one_lines_call_per_path(monkeypatch):
+    from reportlab.pdfgen import canvas
+    from urllib.parse import quote
+
+    svg = (
+        '<svg width="600" height="180">'
+        '<path d="M 10 20 L 30 40 L 50 25"/>'
+        '<path d="M 100 100 L 110 120"/>'
+        '</svg>'
+    )
+    link = {"items": []}
+    supplier = {
+        "first_name": "Mario",
+        "last_name": "Rossi",
+        "signature": f"data:image/svg+xml,{quote(svg)}",
+    }
+    template = server._PURCHASE_PDF_TEMPLATES.get("acquisto")
+    if template is None:
+        pytest.skip("purchase PDF template not available")
+
+    calls = []
+
+    class RecordingCanvas(canvas.Canvas):
+        def lines(self, linelist):
+            calls.append([list(seg) for seg in linelist])
+            return super().lines(linelist)
+
+    monkeypatch.setattr(canvas, "Canvas", RecordingCanvas)
+    pdf = server._build_purchase_pdf_bytes(link, supplier, "acquisto", template)
+    assert pdf.startswith(b"%PDF")
+    assert [len(segs) for segs in calls] == [2, 1]